@@ -0,0 +1,212 @@
+# evaluationUtils.py
+# ------------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+"""
+Array helpers for evaluation functions.
+
+Positions are handled as a pair of coordinate arrays (xs, ys), so distance
+features between Pacman and all food, capsules or ghosts are computed in a
+few array operations instead of a Python loop per cell.  NumPy is used when
+it is installed; otherwise the same functions fall back on plain lists.
+"""
+
+from layout import UNREACHABLE
+
+try:
+    import numpy
+    _NUMPY_ENABLED = True
+except ImportError:
+    _NUMPY_ENABLED = False
+
+_CELL_COORDINATES = {}
+_CELL_ID_ARRAYS = {}
+
+# Food grids repeat across a search, so their unpacked coordinates are kept
+# until this many different grids have been seen
+GRID_COORDINATE_CACHE_SIZE = 4096
+_GRID_COORDINATES = {}
+
+
+def available():
+    """ Whether NumPy is installed, so the functions here work on arrays. """
+    return _NUMPY_ENABLED
+
+
+def cellCoordinates(width, height):
+    """
+    The (xs, ys) arrays of every cell of a width x height grid, indexed by
+    x * height + y like the bits of a BitGrid.
+    """
+    if (width, height) not in _CELL_COORDINATES:
+        xs = [index // height for index in range(width * height)]
+        ys = [index % height for index in range(width * height)]
+        if _NUMPY_ENABLED:
+            xs, ys = numpy.array(xs), numpy.array(ys)
+        _CELL_COORDINATES[(width, height)] = xs, ys
+    return _CELL_COORDINATES[(width, height)]
+
+
+def gridCoordinates(grid):
+    """
+    The (xs, ys) arrays of the True cells of a grid, in asList order (by x,
+    then y).  BitGrids are unpacked straight from their bitmask and the
+    result is cached by bitmask, so it must not be modified.
+    """
+    if not hasattr(grid, 'bits'):
+        return positionCoordinates(grid.asList())
+    key = (grid.width, grid.height, grid.bits)
+    if key in _GRID_COORDINATES:
+        return _GRID_COORDINATES[key]
+    xs, ys = cellCoordinates(grid.width, grid.height)
+    cells = grid.width * grid.height
+    if _NUMPY_ENABLED:
+        packed = numpy.frombuffer(grid.bits.to_bytes((cells + 7) // 8, 'little'), dtype=numpy.uint8)
+        indices = numpy.flatnonzero(numpy.unpackbits(packed, count=cells, bitorder='little'))
+        coordinates = xs[indices], ys[indices]
+    else:
+        indices = [index for index in range(cells) if grid.bits >> index & 1]
+        coordinates = [xs[index] for index in indices], [ys[index] for index in indices]
+    if len(_GRID_COORDINATES) >= GRID_COORDINATE_CACHE_SIZE:
+        _GRID_COORDINATES.clear()
+    _GRID_COORDINATES[key] = coordinates
+    return coordinates
+
+
+def positionCoordinates(positions):
+    """ The (xs, ys) arrays of a list of (x, y) positions. """
+    xs = [x for x, y in positions]
+    ys = [y for x, y in positions]
+    if _NUMPY_ENABLED:
+        return numpy.array(xs, dtype=float), numpy.array(ys, dtype=float)
+    return xs, ys
+
+
+def manhattanDistances(position, coordinates):
+    """ The Manhattan distances from position to each of (xs, ys). """
+    px, py = position
+    xs, ys = coordinates
+    if _NUMPY_ENABLED:
+        return numpy.abs(xs - px) + numpy.abs(ys - py)
+    return [abs(x - px) + abs(y - py) for x, y in zip(xs, ys)]
+
+
+def mazeDistances(layout, position, coordinates):
+    """
+    The maze distances from position to each of (xs, ys), read from the
+    layout's distance table in one row lookup.  Walls and positions off the
+    board are UNREACHABLE, as in Layout.mazeDistance.
+    """
+    if layout.distances is None:
+        layout.initializeDistances()
+    xs, ys = coordinates
+    source = layout.cellId(position)
+    if _NUMPY_ENABLED:
+        if source < 0:
+            return numpy.full(len(xs), UNREACHABLE, dtype=int)
+        if layout.digest not in _CELL_ID_ARRAYS:
+            _CELL_ID_ARRAYS[layout.digest] = numpy.array(layout.cellIds)
+        cx, cy = (numpy.asarray(xs) + 0.5).astype(int), (numpy.asarray(ys) + 0.5).astype(int)
+        onBoard = (cx >= 0) & (cx < layout.width) & (cy >= 0) & (cy < layout.height)
+        ids = numpy.where(onBoard, _CELL_ID_ARRAYS[layout.digest][numpy.where(onBoard, cx * layout.height + cy, 0)], -1)
+        distances = numpy.asarray(layout.distances[source], dtype=int)[ids]
+        distances[ids < 0] = UNREACHABLE
+        return distances
+    if source < 0:
+        return [UNREACHABLE] * len(xs)
+    row = layout.distances[source]
+    ids = [layout.cellId(target) for target in zip(xs, ys)]
+    return [row[id] if id >= 0 else UNREACHABLE for id in ids]
+
+
+def select(condition, then, otherwise, *arrays):
+    """
+    Element-wise then(*items) where condition(*items) holds and otherwise(*items)
+    elsewhere, over equally long arrays.  then and otherwise may be constants.
+    With NumPy both branches are computed for every element (their floating
+    point warnings silenced) and the selected values kept.
+    """
+    pick = lambda branch, items: branch(*items) if callable(branch) else branch
+    if not _NUMPY_ENABLED:
+        return [pick(then, items) if condition(*items) else pick(otherwise, items) for items in zip(*arrays)]
+    arrays = [numpy.asarray(array) for array in arrays]
+    with numpy.errstate(all='ignore'):
+        return numpy.where(condition(*arrays), pick(then, arrays), pick(otherwise, arrays))
+
+
+def sequentialSum(values, start=0):
+    """
+    Adds values to start one at a time, left to right, so the result matches
+    an equivalent Python loop exactly (numpy.sum adds pairwise, which can
+    differ in the last bits of a float).
+    """
+    if _NUMPY_ENABLED:
+        values = numpy.asarray(values).tolist()
+    for value in values:
+        start += value
+    return start
+
+
+def distanceSum(distances):
+    """ The sum of an array of distances. """
+    if _NUMPY_ENABLED:
+        return distances.sum().item()
+    return sum(distances)
+
+
+def minDistance(distances):
+    """ The smallest of an array of distances, or None if it is empty. """
+    if len(distances) == 0:
+        return None
+    if _NUMPY_ENABLED:
+        return distances.min().item()
+    return min(distances)
+
+
+def inverseDistanceSum(distances):
+    """ The sum of 1 / (1 + d) over an array of distances. """
+    if _NUMPY_ENABLED:
+        return (1.0 / (1.0 + distances)).sum().item()
+    return sum(1.0 / (1.0 + distance) for distance in distances)
+
+
+def distanceFeatures(distances):
+    """ The (sum, minimum, inverse sum) features of an array of distances. """
+    return distanceSum(distances), minDistance(distances), inverseDistanceSum(distances)
+
+
+def evaluationFeatures(gameState, maze=False):
+    """
+    Distance features between Pacman and the food, capsules and ghosts of a
+    state, as a dict of '<food|capsule|ghost><Sum|Min|Inverse>' entries plus
+    the raw 'ghostDistances' and 'scaredTimers'.  Uses maze distances from
+    the layout's table instead of Manhattan distances if maze is set.
+    """
+    position = gameState.getPacmanPosition()
+    ghostStates = gameState.getGhostStates()
+    if maze:
+        measure = lambda coordinates: mazeDistances(gameState.data.layout, position, coordinates)
+    else:
+        measure = lambda coordinates: manhattanDistances(position, coordinates)
+    groups = {
+        'food': gridCoordinates(gameState.getFood()),
+        'capsule': positionCoordinates(gameState.getCapsules()),
+        'ghost': positionCoordinates([ghostState.getPosition() for ghostState in ghostStates]),
+    }
+    features = {}
+    for name, coordinates in groups.items():
+        distances = measure(coordinates)
+        features[name + 'Sum'], features[name + 'Min'], features[name + 'Inverse'] = distanceFeatures(distances)
+        if name == 'ghost':
+            features['ghostDistances'] = distances
+    features['scaredTimers'] = [ghostState.scaredTimer for ghostState in ghostStates]
+    return features
@@ -37,6 +37,7 @@ class Agent:
     following methods which will be called if they exist:
 
     def registerInitialState(self, state): # inspects the starting state
+    def registerTimeLimits(self, moveTime, totalTime): # learns the time budgets (totalTime None if not enforced)
     """
 
     def __init__(self, index=0):
@@ -71,6 +72,18 @@ class Directions:
                WEST: EAST,
                STOP: STOP}
 
+    # Small-int codes used inside the engine, and the same tables indexed by code
+    CODES = {NORTH: 0,
+             SOUTH: 1,
+             EAST: 2,
+             WEST: 3,
+             STOP: 4}
+    NAMES = (NORTH, SOUTH, EAST, WEST, STOP)
+    STOP_CODE = 4
+    LEFT_CODES = (3, 2, 0, 1, 4)
+    RIGHT_CODES = (2, 3, 1, 0, 4)
+    REVERSE_CODES = (1, 0, 3, 2, 4)
+
 
 class Configuration:
     """
@@ -79,17 +92,37 @@ class Configuration:
 
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
+
+    Configurations are immutable (moving makes a new one), so they can be
+    shared between states and their hash is computed only once.  The
+    direction is kept as its code in Directions.CODES.
     """
+    __slots__ = ('pos', 'code', '_hash')
 
     def __init__(self, pos, direction):
-        self.pos = pos
-        self.direction = direction
+        object.__setattr__(self, 'pos', pos)
+        object.__setattr__(self, 'code', Directions.CODES[direction])
+
+    def fromCode(pos, code):
+        """ Builds a Configuration from a direction code. """
+        configuration = Configuration.__new__(Configuration)
+        object.__setattr__(configuration, 'pos', pos)
+        object.__setattr__(configuration, 'code', code)
+        return configuration
+    fromCode = staticmethod(fromCode)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Configuration is immutable')
+
+    def __reduce__(self):
+        return Configuration, (self.pos, self.direction)
 
     def getPosition(self):
         return (self.pos)
 
     def getDirection(self):
-        return self.direction
+        return Directions.NAMES[self.code]
+    direction = property(getDirection)
 
     def isInteger(self):
         x, y = self.pos
@@ -98,12 +131,15 @@ class Configuration:
     def __eq__(self, other):
         if other == None:
             return False
-        return (self.pos == other.pos and self.direction == other.direction)
+        return (self.pos == other.pos and self.code == other.code)
 
     def __hash__(self):
-        x = hash(self.pos)
-        y = hash(self.direction)
-        return hash(x + 13 * y)
+        try:
+            return self._hash
+        except AttributeError:
+            x = hash(self.pos)
+            object.__setattr__(self, '_hash', hash(x + 13 * self.code))
+            return self._hash
 
     def __str__(self):
         return "(x,y)="+str(self.pos)+", "+str(self.direction)
@@ -118,16 +154,30 @@ class Configuration:
         """
         x, y = self.pos
         dx, dy = vector
-        direction = Actions.vectorToDirection(vector)
-        if direction == Directions.STOP:
-            direction = self.direction  # There is no stop direction
-        return Configuration((x + dx, y+dy), direction)
+        code = _VECTOR_CODES.get(vector)
+        if code is None:
+            code = Directions.CODES[Actions.vectorToDirection(vector)]
+        if code == Directions.STOP_CODE:
+            code = self.code  # There is no stop direction
+        return Configuration.fromCode((x + dx, y+dy), code)
+
+    def generateCodeSuccessor(self, code, speed):
+        """
+        The configuration reached by moving speed along the direction with
+        the given code; the same as generateSuccessor of its vector.
+        """
+        x, y = self.pos
+        dx, dy = Actions._codeVectors[code]
+        if code == Directions.STOP_CODE:
+            code = self.code
+        return Configuration.fromCode((x + dx * speed, y + dy * speed), code)
 
 
 class AgentState:
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
 
     def __init__(self, startConfiguration, isPacman):
         self.start = startConfiguration
@@ -153,8 +203,10 @@ class AgentState:
         return hash(hash(self.configuration) + 13 * hash(self.scaredTimer))
 
     def copy(self):
-        state = AgentState(self.start, self.isPacman)
+        state = AgentState.__new__(AgentState)
+        state.start = self.start
         state.configuration = self.configuration
+        state.isPacman = self.isPacman
         state.scaredTimer = self.scaredTimer
         state.numCarrying = self.numCarrying
         state.numReturned = self.numReturned
@@ -262,7 +314,7 @@ class Grid:
         return tuple(bits)
 
     def _cellIndexToPosition(self, index):
-        x = index / self.height
+        x = index // self.height
         y = index % self.height
         return x, y
 
@@ -299,6 +351,152 @@ def reconstituteGrid(bitRep):
     width, height = bitRep[:2]
     return Grid(width, height, bitRepresentation=bitRep[2:])
 
+
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    def _popcount(n):
+        return bin(n).count('1')
+
+
+class BitGrid(Grid):
+    """
+    A boolean Grid backed by a single Python int.  Cell (x,y) is stored in
+    bit x * height + y, so grid[x][y], count, asList and equality behave
+    exactly like Grid while copy, count and hash no longer walk every cell.
+
+    Since the backing int is immutable, copy, deepCopy and shallowCopy all
+    return an independent grid in O(1).
+
+    A frozenset of the True cells can be attached with setPositions; asList
+    then serves from it until the grid is next written to.
+    """
+
+    def __init__(self, width, height, initialValue=False, bits=0):
+        if initialValue not in [False, True]:
+            raise Exception('Grids can only contain booleans')
+        self.CELLS_PER_INT = 30
+
+        self.width = width
+        self.height = height
+        if initialValue:
+            bits = (1 << (width * height)) - 1
+        self.bits = bits
+        self._positions = None
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        if x < 0 or x >= self.width:
+            raise IndexError('grid index out of range')
+        return _BitGridColumn(self, x * self.height)
+
+    def __setitem__(self, x, column):
+        target = self[x]
+        for y, value in enumerate(column):
+            target[y] = value
+
+    def _getData(self):
+        return [list(self[x]) for x in range(self.width)]
+    data = property(_getData)
+
+    def __str__(self):
+        data = self.data
+        out = [[str(data[x][y])[0] for x in range(self.width)]
+               for y in range(self.height)]
+        out.reverse()
+        return '\n'.join([''.join(x) for x in out])
+
+    def __eq__(self, other):
+        if other == None:
+            return False
+        if isinstance(other, BitGrid):
+            return self.bits == other.bits and self.width == other.width and self.height == other.height
+        return self.data == other.data
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def copy(self):
+        g = BitGrid(self.width, self.height, bits=self.bits)
+        g._positions = self._positions
+        return g
+
+    def deepCopy(self):
+        return self.copy()
+
+    def shallowCopy(self):
+        return self.copy()
+
+    def count(self, item=True):
+        n = _popcount(self.bits)
+        if item:
+            return n
+        return self.width * self.height - n
+
+    def setPositions(self, positions):
+        """
+        Caches the frozenset of True cells, which must match the grid's bits.
+        """
+        self._positions = positions
+
+    def asList(self, key=True):
+        if key and self._positions is not None:
+            return sorted(self._positions)
+        bits = self.bits
+        if not key:
+            bits = ~bits & ((1 << (self.width * self.height)) - 1)
+        height = self.height
+        list = []
+        while bits:
+            low = bits & -bits
+            index = low.bit_length() - 1
+            list.append((index // height, index % height))
+            bits ^= low
+        return list
+
+
+class _BitGridColumn:
+    """
+    A view of column x of a BitGrid, so that grid[x][y] reads and writes
+    the parent's bits.
+    """
+    __slots__ = ('grid', 'offset')
+
+    def __init__(self, grid, offset):
+        self.grid = grid
+        self.offset = offset
+
+    def __len__(self):
+        return self.grid.height
+
+    def __getitem__(self, y):
+        height = self.grid.height
+        if y < 0:
+            y += height
+        if y < 0 or y >= height:
+            raise IndexError('grid index out of range')
+        return (self.grid.bits >> (self.offset + y)) & 1 == 1
+
+    def __setitem__(self, y, value):
+        height = self.grid.height
+        if y < 0:
+            y += height
+        if y < 0 or y >= height:
+            raise IndexError('grid index out of range')
+        if value not in [False, True]:
+            raise Exception('Grids can only contain booleans')
+        self.grid._positions = None
+        if value:
+            self.grid.bits |= 1 << (self.offset + y)
+        else:
+            self.grid.bits &= ~(1 << (self.offset + y))
+
+    def __iter__(self):
+        bits = self.grid.bits >> self.offset
+        for y in range(self.grid.height):
+            yield (bits >> y) & 1 == 1
+
 ####################################
 # Parts you shouldn't have to read #
 ####################################
@@ -317,18 +515,13 @@ class Actions:
 
     _directionsAsList = [('West', (-1, 0)), ('Stop', (0, 0)), ('East', (1, 0)), ('North', (0, 1)), ('South', (0, -1))]
 
+    # Vectors indexed by direction code (Directions.NAMES order)
+    _codeVectors = ((0, 1), (0, -1), (1, 0), (-1, 0), (0, 0))
+
     TOLERANCE = .001
 
     def reverseDirection(action):
-        if action == Directions.NORTH:
-            return Directions.SOUTH
-        if action == Directions.SOUTH:
-            return Directions.NORTH
-        if action == Directions.EAST:
-            return Directions.WEST
-        if action == Directions.WEST:
-            return Directions.EAST
-        return action
+        return Directions.REVERSE.get(action, action)
     reverseDirection = staticmethod(reverseDirection)
 
     def vectorToDirection(vector):
@@ -393,19 +586,40 @@ class Actions:
     getSuccessor = staticmethod(getSuccessor)
 
 
+# Direction code of each movement vector an agent can be given, so that
+# moving does not have to classify the vector again
+_VECTOR_CODES = {Actions.directionToVector(direction, speed): Directions.CODES[direction]
+                 for direction in Actions._directions for speed in (1, 0.5)}
+
+
 class GameStateData:
+    __slots__ = ('food', 'numFood', 'foodPositions', 'capsules', 'capsuleMask', 'agentStates', 'layout',
+                 '_eaten', 'score', 'scoreChange', '_agentKeys', 'key', '_hash', '_copiedAgents',
+                 '_foodEaten', '_foodAdded', '_capsuleEaten', '_agentMoved', '_lose', '_win')
 
     def __init__(self, prevState=None):
         """
-        Generates a new data packet by copying information from its predecessor.
+        Generates a new data packet from its predecessor.
+
+        The food grid, capsule list, _eaten flags and every AgentState are
+        shared with prevState (copy-on-write).  Code that changes one of them
+        must first replace it with a private copy: see copyAgentState for
+        agents, while food, capsules and _eaten are swapped for new objects.
         """
-        if prevState != None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates(prevState.agentStates)
+        if prevState is not None:
+            self.food = prevState.food
+            self.numFood = prevState.numFood
+            self.foodPositions = prevState.foodPositions
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self.capsuleMask = prevState.capsuleMask
+            self._agentKeys = prevState._agentKeys
+            self.key = prevState.key
+            self._hash = prevState._hash
+        self._copiedAgents = 0  # Bit i is set once agent i has its own AgentState
 
         self._foodEaten = None
         self._foodAdded = None
@@ -416,9 +630,15 @@ class GameStateData:
         self.scoreChange = 0
 
     def deepCopy(self):
+        """
+        Copies the mutable parts of the state.  The layout is read-only and,
+        as between successors, shared by reference rather than rebuilt.
+        """
         state = GameStateData(self)
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates(self.agentStates)
+        state._eaten = self._eaten[:]
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
@@ -431,6 +651,60 @@ class GameStateData:
             copiedStates.append(agentState.copy())
         return copiedStates
 
+    def copyAgentState(self, index):
+        """
+        Returns an AgentState for the agent at index that is private to this
+        data packet, copying the shared one from the predecessor on first use.
+        """
+        if not self._copiedAgents >> index & 1:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._copiedAgents |= 1 << index
+        return self.agentStates[index]
+
+    def _packAgentState(self, agentState):
+        """
+        Packs an agent's position, direction and scared timer into one int.
+        Positions are doubled so that the half-steps of scared ghosts stay
+        integral.
+        """
+        conf = agentState.configuration
+        if conf is None:
+            return -1
+        x, y = conf.pos
+        cells = 4 * self.layout.width * self.layout.height
+        cell = int(x * 2) * 2 * self.layout.height + int(y * 2)
+        return (agentState.scaredTimer * cells + cell) * 5 + conf.code
+
+    def _foodKey(self):
+        if isinstance(self.food, BitGrid):
+            return self.food.bits
+        return self.foodPositions
+
+    def initializeKey(self):
+        """
+        Builds the state key from scratch.
+        """
+        self._agentKeys = tuple([self._packAgentState(agentState)
+                                 for agentState in self.agentStates])
+        self.key = (self._foodKey(), self.capsuleMask, self._agentKeys)
+        self._hash = None
+
+    def updateKey(self):
+        """
+        Refreshes the state key after a move, repacking only the agents that
+        were copied (and so possibly changed) since the predecessor.
+        """
+        agentKeys = self._agentKeys
+        if self._copiedAgents:
+            agentKeys = list(agentKeys)
+            for index in range(len(agentKeys)):
+                if self._copiedAgents >> index & 1:
+                    agentKeys[index] = self._packAgentState(self.agentStates[index])
+            agentKeys = tuple(agentKeys)
+            self._agentKeys = agentKeys
+        self.key = (self._foodKey(), self.capsuleMask, agentKeys)
+        self._hash = None
+
     def __eq__(self, other):
         """
         Allows two states to be compared.
@@ -438,27 +712,15 @@ class GameStateData:
         if other == None:
             return False
         # TODO Check for type of other
-        if not self.agentStates == other.agentStates:
-            return False
-        if not self.food == other.food:
-            return False
-        if not self.capsules == other.capsules:
-            return False
-        if not self.score == other.score:
-            return False
-        return True
+        return self.key == other.key and self.score == other.score
 
     def __hash__(self):
         """
         Allows states to be keys of dictionaries.
         """
-        for i, state in enumerate(self.agentStates):
-            try:
-                int(hash(state))
-            except TypeError as e:
-                print(e)
-                # hash(state)
-        return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113 * hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575)
+        if self._hash is None:
+            self._hash = hash((self.key, self.score))
+        return self._hash
 
     def __str__(self):
         width, height = self.layout.width, self.layout.height
@@ -519,8 +781,13 @@ class GameStateData:
         Creates an initial game state from a layout array (see layout.py).
         """
         self.food = layout.food.copy()
+        self.foodPositions = frozenset(self.food.asList())
+        self.numFood = len(self.foodPositions)
+        if isinstance(self.food, BitGrid):
+            self.food.setPositions(self.foodPositions)
         #self.capsules = []
         self.capsules = layout.capsules[:]
+        self.capsuleMask = (1 << len(self.capsules)) - 1
         self.layout = layout
         self.score = 0
         self.scoreChange = 0
@@ -536,6 +803,7 @@ class GameStateData:
             self.agentStates.append(AgentState(
                 Configuration(pos, Directions.STOP), isPacman))
         self._eaten = [False for a in self.agentStates]
+        self.initializeKey()
 
 
 try:
@@ -620,6 +888,11 @@ class Game:
                 self.unmute()
                 self._agentCrash(i, quiet=True)
                 return
+            if ("registerTimeLimits" in dir(agent)):
+                # The game limit is only enforced when exceptions are caught
+                totalTime = self.rules.getMaxTotalTime(i) if self.catchExceptions else None
+                agent.registerTimeLimits(min(self.rules.getMoveTimeout(i), self.rules.getMoveWarningTime(
+                    i)), totalTime)
             if ("registerInitialState" in dir(agent)):
                 self.mute(i)
                 if self.catchExceptions:
@@ -650,6 +923,9 @@ class Game:
         agentIndex = self.startingIndex
         numAgents = len(self.agents)
 
+        if not self.catchExceptions and 'checkNullDisplay' in dir(self.display) and self.display.checkNullDisplay():
+            self.runHeadless(agentIndex)
+
         while not self.gameOver:
             # Fetch the next agent
             agent = self.agents[agentIndex]
@@ -776,3 +1052,36 @@ class Game:
                     self.unmute()
                     return
         self.display.finish()
+
+    def runHeadless(self, agentIndex):
+        """
+        Plays the game out from agentIndex's turn when nothing is displayed
+        and agent exceptions are not caught.  The agents' observation hooks
+        are looked up once, and there are no per-move timeouts, clock reads
+        or display updates; otherwise it plays the same moves as run.
+        """
+        agents = self.agents
+        numAgents = len(agents)
+        observationFunctions = [agent.observationFunction if 'observationFunction' in dir(agent) else None
+                                for agent in agents]
+        getActions = [agent.getAction for agent in agents]
+        rules = self.rules
+        moveHistory = self.moveHistory
+        mute, unmute = self.mute, self.unmute
+
+        while not self.gameOver:
+            mute(agentIndex)
+            observation = self.state.deepCopy()
+            observationFunction = observationFunctions[agentIndex]
+            if observationFunction is not None:
+                observation = observationFunction(observation)
+            action = getActions[agentIndex](observation)
+            unmute()
+
+            moveHistory.append((agentIndex, action))
+            self.state = self.state.generateSuccessor(agentIndex, action)
+            rules.process(self.state, self)
+            agentIndex = (agentIndex + 1) % numAgents
+
+            if _BOINC_ENABLED:
+                boinc.set_fraction_done(self.getProgress())
@@ -0,0 +1,136 @@
+# gameRecords.py
+# --------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+"""
+Binary files of recorded games.
+
+A record file starts with RECORD_MAGIC and a version byte, followed by any
+number of blocks, so games from many runs can be appended to one file and
+read back one at a time:
+
+  b'L' layout block: the layout's SHA-1 digest (20 bytes), the length of its
+       text (uint32) and the text itself, written before the first game on
+       that layout by each writer.
+  b'G' game block:   the layout digest, the number of ghosts (uint8), the
+       final score (float64), the number of moves (uint32) and the moves,
+       one packMoves byte each.
+
+All numbers are little-endian.
+"""
+
+import os
+import struct
+from game import Directions
+import layout as layouts
+
+RECORD_MAGIC = b'PACREC'
+RECORD_VERSION = 1
+
+_LAYOUT_BLOCK = struct.Struct('<20sI')
+_GAME_BLOCK = struct.Struct('<20sBdI')
+
+
+def packMoves(moveHistory):
+    """
+    Packs a game's (agentIndex, action) moves into one byte each, the agent
+    index in the high bits and the direction code in the low three.
+    """
+    return bytes([agentIndex << 3 | Directions.CODES[action] for agentIndex, action in moveHistory])
+
+
+def unpackMoves(packed):
+    """ The (agentIndex, action) moves of a packMoves byte string. """
+    return [(byte >> 3, Directions.NAMES[byte & 7]) for byte in packed]
+
+
+class GameRecord:
+    """
+    One recorded game: its Layout, number of ghosts, final score and packed
+    moves (see getActions).
+    """
+    __slots__ = ('layout', 'numGhosts', 'score', 'moves')
+
+    def __init__(self, layout, numGhosts, score, moves):
+        self.layout = layout
+        self.numGhosts = numGhosts
+        self.score = score
+        self.moves = moves
+
+    def getActions(self):
+        """ The game's (agentIndex, action) moves. """
+        return unpackMoves(self.moves)
+
+
+class GameRecordWriter:
+    """
+    Appends games to a record file, creating it (with its header) if needed.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(RECORD_MAGIC + bytes([RECORD_VERSION]))
+        self.writtenLayouts = set()
+
+    def writeGame(self, layout, numGhosts, score, moveHistory):
+        digest = bytes.fromhex(layout.digest)
+        if digest not in self.writtenLayouts:
+            text = "\n".join(layout.layoutText).encode()
+            self.file.write(b'L' + _LAYOUT_BLOCK.pack(digest, len(text)) + text)
+            self.writtenLayouts.add(digest)
+        moves = packMoves(moveHistory)
+        self.file.write(b'G' + _GAME_BLOCK.pack(digest, numGhosts, score, len(moves)) + moves)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def readGameRecords(path):
+    """
+    Yields the GameRecords of a record file in order, reading one block at a
+    time.  Games on the same layout share one Layout object.
+    """
+    def readExactly(f, size):
+        data = f.read(size)
+        if len(data) != size:
+            raise Exception('Truncated game record file: ' + path)
+        return data
+
+    with open(path, 'rb') as f:
+        header = f.read(len(RECORD_MAGIC) + 1)
+        if header[:len(RECORD_MAGIC)] != RECORD_MAGIC:
+            raise Exception('Not a game record file: ' + path)
+        if header[-1] != RECORD_VERSION:
+            raise Exception('Unsupported game record version %d in %s' % (header[-1], path))
+        layoutsByDigest = {}
+        while True:
+            tag = f.read(1)
+            if not tag:
+                return
+            if tag == b'L':
+                digest, length = _LAYOUT_BLOCK.unpack(readExactly(f, _LAYOUT_BLOCK.size))
+                if digest not in layoutsByDigest:
+                    layout = layouts.Layout(readExactly(f, length).decode().split("\n"))
+                    if bytes.fromhex(layout.digest) != digest:
+                        raise Exception('Layout does not match its digest in ' + path)
+                    layoutsByDigest[digest] = layout
+                else:
+                    f.seek(length, os.SEEK_CUR)
+            elif tag == b'G':
+                digest, numGhosts, score, length = _GAME_BLOCK.unpack(readExactly(f, _GAME_BLOCK.size))
+                if digest not in layoutsByDigest:
+                    raise Exception('Game on an unknown layout in ' + path)
+                yield GameRecord(layoutsByDigest[digest], numGhosts, score, readExactly(f, length))
+            else:
+                raise Exception('Corrupt game record file: ' + path)
@@ -13,12 +13,88 @@
 
 
 from util import manhattanDistance
-from game import Grid
+from game import BitGrid
+from game import Actions
+from game import Configuration
+from game import Directions
 import os
 import random
-from functools import reduce
+import hashlib
+import json
+import tempfile
+from array import array
+
+try:
+    import numpy
+    _NUMPY_ENABLED = True
+except ImportError:
+    _NUMPY_ENABLED = False
 
 VISIBILITY_MATRIX_CACHE = {}
+DISTANCE_TABLE_CACHE = {}
+ACTION_TABLE_CACHE = {}
+UNREACHABLE = 32767
+
+# Directory of the on-disk layout cache; set PACMAN_LAYOUT_CACHE to '' to disable it
+LAYOUT_CACHE_DIR = os.environ.get('PACMAN_LAYOUT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pacman', 'layouts'))
+# Part of every cache file name; bump it whenever the format of an entry changes
+LAYOUT_CACHE_VERSION = 2
+
+
+def layoutDigest(layoutText):
+    """ A content hash of a layout, naming its entries in the caches. """
+    return hashlib.sha1("\n".join(layoutText).encode()).hexdigest()
+
+
+def layoutCachePath(digest, name):
+    return os.path.join(LAYOUT_CACHE_DIR, '%s.v%d.%s' % (digest, LAYOUT_CACHE_VERSION, name))
+
+
+def readLayoutCache(digest, name):
+    """
+    Returns the value stored on disk for a layout under name, or None if
+    there is none or it cannot be read.  Entries hold plain data: names
+    ending in .npy are NumPy arrays, loaded memory-mapped read-only and
+    without pickle, and the rest are JSON.  The directory may be shared, so
+    callers check the shape of what they get and rebuild it if it is wrong.
+    """
+    if not LAYOUT_CACHE_DIR:
+        return None
+    path = layoutCachePath(digest, name)
+    try:
+        if name.endswith('.npy'):
+            if not _NUMPY_ENABLED:
+                return None
+            return numpy.load(path, mmap_mode='r', allow_pickle=False)
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def writeLayoutCache(digest, name, value):
+    """
+    Stores a value on disk for a layout.  The file is written under a
+    temporary name and renamed into place, so concurrent processes never
+    read a partial entry; failures only mean the next run recomputes.
+    """
+    if not LAYOUT_CACHE_DIR:
+        return
+    try:
+        os.makedirs(LAYOUT_CACHE_DIR, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=LAYOUT_CACHE_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if name.endswith('.npy'):
+                    numpy.save(f, value, allow_pickle=False)
+                else:
+                    f.write(json.dumps(value).encode())
+            os.replace(tmpPath, layoutCachePath(digest, name))
+        except BaseException:
+            os.remove(tmpPath)
+            raise
+    except OSError:
+        pass
 
 
 class Layout:
@@ -29,42 +105,269 @@ class Layout:
     def __init__(self, layoutText):
         self.width = len(layoutText[0])
         self.height = len(layoutText)
-        self.walls = Grid(self.width, self.height, False)
-        self.food = Grid(self.width, self.height, False)
-        self.capsules = []
-        self.agentPositions = []
-        self.numGhosts = 0
-        self.processLayoutText(layoutText)
+        self.digest = layoutDigest(layoutText)
+        if not self.readCachedLayout():
+            self.walls = BitGrid(self.width, self.height, False)
+            self.food = BitGrid(self.width, self.height, False)
+            self.capsules = []
+            self.agentPositions = []
+            self.numGhosts = 0
+            self.processLayoutText(layoutText)
+            writeLayoutCache(self.digest, 'layout.json', {
+                'walls': self.walls.bits, 'food': self.food.bits, 'capsules': self.capsules,
+                'agentPositions': self.agentPositions, 'numGhosts': self.numGhosts})
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
+        self.distances = None
+        self.actionTable = None
         # self.initializeVisibilityMatrix()
 
+    def readCachedLayout(self):
+        """
+        Sets the parsed walls, food, capsules and agents from the disk cache,
+        returning False (and setting nothing) if there is no valid entry.
+        """
+        entry = readLayoutCache(self.digest, 'layout.json')
+        limit = 1 << (self.width * self.height)
+        try:
+            wallBits, foodBits, numGhosts = entry['walls'], entry['food'], entry['numGhosts']
+            capsules = [(x, y) for x, y in entry['capsules']]
+            agentPositions = [(isPacman, (x, y)) for isPacman, (x, y) in entry['agentPositions']]
+            positions = capsules + [pos for isPacman, pos in agentPositions]
+            if not (type(wallBits) is int and 0 <= wallBits < limit and type(foodBits) is int and 0 <= foodBits < limit
+                    and type(numGhosts) is int and all(type(isPacman) is bool for isPacman, pos in agentPositions)
+                    and all(type(x) is int and type(y) is int and 0 <= x < self.width and 0 <= y < self.height
+                            for x, y in positions)):
+                return False
+        except (TypeError, KeyError, ValueError):
+            return False
+        self.walls = BitGrid(self.width, self.height, bits=wallBits)
+        self.food = BitGrid(self.width, self.height, bits=foodBits)
+        self.capsules, self.agentPositions, self.numGhosts = capsules, agentPositions, numGhosts
+        return True
+
     def getNumGhosts(self):
         return self.numGhosts
 
     def initializeVisibilityMatrix(self):
-        global VISIBILITY_MATRIX_CACHE
-        if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
-            from game import Directions
-            vecs = [(-0.5, 0), (0.5, 0), (0, -0.5), (0, 0.5)]
-            dirs = [Directions.NORTH, Directions.SOUTH,
-                    Directions.WEST, Directions.EAST]
-            vis = Grid(self.width, self.height, {Directions.NORTH: set(), Directions.SOUTH: set(
-            ), Directions.EAST: set(), Directions.WEST: set(), Directions.STOP: set()})
-            for x in range(self.width):
-                for y in range(self.height):
-                    if self.walls[x][y] == False:
-                        for vec, direction in zip(vecs, dirs):
-                            dx, dy = vec
-                            nextx, nexty = x + dx, y + dy
-                            while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)]:
-                                vis[x][y][direction].add((nextx, nexty))
+        """
+        For every open cell and direction, collects the (half-step) positions
+        a Pacman there facing that way can see before the next wall.
+        """
+        if self.digest not in VISIBILITY_MATRIX_CACHE:
+            vis = self.readCachedVisibility()
+            if vis is None:
+                from game import Directions
+                vecs = [(0, 0.5), (0, -0.5), (-0.5, 0), (0.5, 0)]
+                dirs = [Directions.NORTH, Directions.SOUTH,
+                        Directions.WEST, Directions.EAST]
+                vis = [[{direction: set() for direction in dirs + [Directions.STOP]}
+                        for y in range(self.height)] for x in range(self.width)]
+                for x in range(self.width):
+                    for y in range(self.height):
+                        if self.walls[x][y] == False:
+                            for vec, direction in zip(vecs, dirs):
+                                dx, dy = vec
                                 nextx, nexty = x + dx, y + dy
-            self.visibility = vis
-            VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
+                                while 0 <= nextx < self.width and 0 <= nexty < self.height and \
+                                        ((nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)]):
+                                    vis[x][y][direction].add((nextx, nexty))
+                                    nextx, nexty = nextx + dx, nexty + dy
+                writeLayoutCache(self.digest, 'visibility.json',
+                                 [[{direction: sorted(seen) for direction, seen in cell.items()} for cell in column] for column in vis])
+            VISIBILITY_MATRIX_CACHE[self.digest] = vis
+        self.visibility = VISIBILITY_MATRIX_CACHE[self.digest]
+
+    def readCachedVisibility(self):
+        """ The visibility matrix from the disk cache, or None if it has no valid entry. """
+        from game import Directions
+        entry = readLayoutCache(self.digest, 'visibility.json')
+        directions = {Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP}
+        try:
+            if len(entry) != self.width or any(len(column) != self.height for column in entry):
+                return None
+            cells = [cell for column in entry for cell in column]
+            if any(not isinstance(cell, dict) or set(cell) != directions for cell in cells):
+                return None
+            if any(not isinstance(seen, list) or
+                   any(not isinstance(pos, list) or len(pos) != 2 or
+                       not all(isinstance(c, (int, float)) for c in pos) for pos in seen)
+                   for cell in cells for seen in cell.values()):
+                return None
+            return [[{direction: set((x, y) for x, y in seen) for direction, seen in cell.items()}
+                     for cell in column] for column in entry]
+        except (TypeError, ValueError, AttributeError):
+            return None
+
+    def initializeDistances(self):
+        """
+        Builds (or fetches from DISTANCE_TABLE_CACHE or the disk cache) the
+        shortest maze distance between every pair of non-wall cells, one
+        breadth-first search per cell.  cellIds maps x * height + y to a cell
+        id (-1 for walls), cells lists the positions by id, neighbors the ids
+        next to each cell, and distances is an int16 matrix indexed by two
+        ids, a NumPy array when NumPy is installed and a list of arrays
+        otherwise.
+        """
+        if self.digest not in DISTANCE_TABLE_CACHE:
+            cached = self.readCachedDistances()
+            if cached is None:
+                cached = self.computeDistances()
+                cellIds, cells, neighbors, distances = cached
+                writeLayoutCache(self.digest, 'cells.json', {'cellIds': cellIds, 'cells': cells, 'neighbors': neighbors})
+                if _NUMPY_ENABLED:
+                    writeLayoutCache(self.digest, 'distances.npy', distances)
+                else:
+                    writeLayoutCache(self.digest, 'distances.json', [row.tolist() for row in distances])
+            DISTANCE_TABLE_CACHE[self.digest] = cached
+        self.cellIds, self.cells, self.neighbors, self.distances = DISTANCE_TABLE_CACHE[self.digest]
+
+    def readCachedDistances(self):
+        """
+        (cellIds, cells, neighbors, distances) from the disk cache, or None if
+        it has no valid entry.
+        """
+        entry = readLayoutCache(self.digest, 'cells.json')
+        try:
+            cellIds = [int(id) for id in entry['cellIds']]
+            cells = [(int(x), int(y)) for x, y in entry['cells']]
+            neighbors = [[int(id) for id in ids] for ids in entry['neighbors']]
+        except (TypeError, KeyError, ValueError):
+            return None
+        n = len(cells)
+        if len(cellIds) != self.width * self.height or len(neighbors) != n or \
+                any(not -1 <= id < n for id in cellIds) or any(not 0 <= id < n for ids in neighbors for id in ids):
+            return None
+        if _NUMPY_ENABLED:
+            distances = readLayoutCache(self.digest, 'distances.npy')
+            if distances is None or distances.dtype != numpy.int16 or distances.shape != (n, n):
+                return None
         else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(
-                str.__add__, self.layoutText)]
+            rows = readLayoutCache(self.digest, 'distances.json')
+            try:
+                distances = [array('h', row) for row in rows]
+            except (TypeError, ValueError, OverflowError):
+                return None
+            if len(distances) != n or any(len(row) != n for row in distances):
+                return None
+        return cellIds, cells, neighbors, distances
+
+    def computeDistances(self):
+        """ Returns (cellIds, cells, neighbors, distances) as described in initializeDistances. """
+        cellIds = [-1] * (self.width * self.height)
+        cells = []
+        for x in range(self.width):
+            for y in range(self.height):
+                if not self.walls[x][y]:
+                    cellIds[x * self.height + y] = len(cells)
+                    cells.append((x, y))
+        neighbors = []
+        for x, y in cells:
+            adjacent = [(x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)]
+            neighbors.append([cellIds[nx * self.height + ny] for nx, ny in adjacent
+                              if 0 <= nx < self.width and 0 <= ny < self.height and not self.walls[nx][ny]])
+        rows = []
+        for source in range(len(cells)):
+            row = array('h', [UNREACHABLE]) * len(cells)
+            row[source] = 0
+            frontier = [source]
+            distance = 0
+            while frontier:
+                distance += 1
+                nextFrontier = []
+                for cell in frontier:
+                    for neighbor in neighbors[cell]:
+                        if row[neighbor] == UNREACHABLE:
+                            row[neighbor] = distance
+                            nextFrontier.append(neighbor)
+                frontier = nextFrontier
+            rows.append(row)
+        if _NUMPY_ENABLED:
+            distances = numpy.array(rows, dtype=numpy.int16).reshape(len(cells), len(cells))
+        else:
+            distances = rows
+        return cellIds, cells, neighbors, distances
+
+    def cellId(self, pos):
+        """ The distance table id of the cell nearest pos, or -1 for walls and off-board positions. """
+        x, y = int(pos[0] + 0.5), int(pos[1] + 0.5)
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return -1
+        return self.cellIds[x * self.height + y]
+
+    def mazeDistance(self, pos1, pos2):
+        """
+        Returns the length of the shortest path through the maze between two
+        positions, or UNREACHABLE if there is none or either is a wall or off
+        the board.  Positions between cells (scared ghosts) are rounded to the
+        nearest cell.
+        """
+        if self.distances is None:
+            self.initializeDistances()
+        id1 = self.cellId(pos1)
+        id2 = self.cellId(pos2)
+        if id1 < 0 or id2 < 0:
+            return UNREACHABLE
+        if _NUMPY_ENABLED:
+            return self.distances.item(id1, id2)
+        return self.distances[id1][id2]
+
+    def initializeActionTable(self):
+        """
+        Builds (or fetches from ACTION_TABLE_CACHE) the legal actions of every
+        open cell: actionTable[x * height + y] holds Pacman's actions there,
+        as Actions.getPossibleActions lists them, and a tuple indexed by the
+        code of the direction an agent is facing of the ghost actions, which
+        drop STOP and (outside dead ends) the reverse direction.
+        betweenCellActions, also indexed by direction code, does the same for
+        agents between cells, which must keep going straight.
+        """
+        if self.digest not in ACTION_TABLE_CACHE:
+            directions = Directions.NAMES
+            def ghostActions(possible, direction):
+                actions = [action for action in possible if action != Directions.STOP]
+                reverse = Actions.reverseDirection(direction)
+                if reverse in actions and len(actions) > 1:
+                    actions.remove(reverse)
+                return tuple(actions)
+            table = [None] * (self.width * self.height)
+            for x in range(self.width):
+                for y in range(self.height):
+                    if self.walls[x][y]:
+                        continue
+                    try:
+                        possible = tuple(Actions.getPossibleActions(Configuration((x, y), Directions.STOP), self.walls))
+                    except IndexError:
+                        continue
+                    table[x * self.height + y] = (possible, tuple(ghostActions(possible, direction) for direction in directions))
+            betweenCells = tuple(((direction,), ghostActions([direction], direction)) for direction in directions)
+            ACTION_TABLE_CACHE[self.digest] = table, betweenCells
+        self.actionTable, self.betweenCellActions = ACTION_TABLE_CACHE[self.digest]
+
+    def legalActions(self, configuration):
+        """
+        Returns the (Pacman, ghost) tuples of legal actions for an agent with
+        the given configuration, from the action table.
+        """
+        if self.actionTable is None:
+            self.initializeActionTable()
+        x, y = configuration.pos
+        code = configuration.code
+        xInt, yInt = int(x + 0.5), int(y + 0.5)
+        if abs(x - xInt) + abs(y - yInt) > Actions.TOLERANCE:
+            return self.betweenCellActions[code]
+        entry = None
+        if 0 <= xInt < self.width and 0 <= yInt < self.height:
+            entry = self.actionTable[xInt * self.height + yInt]
+        if entry is None:
+            # Off the table (a wall or the edge of the board): work it out directly
+            possible = Actions.getPossibleActions(configuration, self.walls)
+            reverse = Directions.NAMES[Directions.REVERSE_CODES[code]]
+            ghost = [action for action in possible if action != Directions.STOP]
+            if reverse in ghost and len(ghost) > 1:
+                ghost.remove(reverse)
+            return tuple(possible), tuple(ghost)
+        return entry[0], entry[1][code]
 
     def isWall(self, pos):
         x, col = pos
@@ -11,11 +11,14 @@
 # Student side autograding was added by Brad Miller, Nick Hay, and
 # Pieter Abbeel (pabbeel@cs.berkeley.edu).
 
-from util import manhattanDistance
-from game import Directions
-import random, util, math
+from game import Directions, Actions
+import random, util, math, time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from game import Agent
 from pacman import GameState
+import ghostAgents
+import evaluationUtils
 
 class ReflexAgent(Agent):
     """
@@ -42,147 +45,843 @@ class ReflexAgent(Agent):
         newPos = successorGameState.getPacmanPosition()
         newFood = successorGameState.getFood()
         newGhostStates = successorGameState.getGhostStates()
-        newScaredTimes = [ghostState.scaredTimer for ghostState in newGhostStates]
         
-        score = 0
-        foods = sum(1 for i in range(newFood.width) for j in range(newFood.height) if newFood[i][j])
+        # Food attracts, each remaining dot costs 1000
+        foodDistances = evaluationUtils.manhattanDistances(newPos, evaluationUtils.gridCoordinates(newFood))
+        score = evaluationUtils.sequentialSum(evaluationUtils.select(
+            lambda dist: dist > 1, lambda dist: (100 / dist) - (3 * dist), 100, foodDistances))
+        score -= 1000 * len(foodDistances)
         
-        for i in range(newFood.width):
-            for j in range(newFood.height):
-                if newFood[i][j]:
-                    dist = abs(i - newPos[0]) + abs(j - newPos[1])
-                    score += (100 / dist) - (3 * dist) if dist > 1 else 100
-        
-        score -= 1000 * foods
-        
-        for ghost in newGhostStates:
-            dist = abs(ghost.getPosition()[0] - newPos[0]) + abs(ghost.getPosition()[1] - newPos[1])
-            if dist <= 3:
-                score -= 100000 * (4 - dist)
-            else:
-                score += dist
-        
-        return score
+        # Ghosts within 3 steps are a disaster, further ones are a small bonus
+        ghostCoordinates = evaluationUtils.positionCoordinates([ghost.getPosition() for ghost in newGhostStates])
+        ghostDistances = evaluationUtils.manhattanDistances(newPos, ghostCoordinates)
+        return evaluationUtils.sequentialSum(evaluationUtils.select(
+            lambda dist: dist <= 3, lambda dist: -100000 * (4 - dist), lambda dist: dist, ghostDistances), score)
 
 def scoreEvaluationFunction(currentGameState: GameState):
     """ This default evaluation function just returns the score of the state. """
     return currentGameState.getScore()
 
+class TranspositionTable:
+    """
+    A bounded table of search results shared by the multi-agent searchers.
+
+    Entries are (depth, flag, value, move) tuples keyed on (state key, agent
+    index), where depth is the number of plies searched below the node and
+    flag says whether value is EXACT or only a LOWER or UPPER bound (alpha-beta).
+    replacement='lru' evicts the least recently used entry once the table is
+    full; replacement='depth' hashes keys into a fixed number of slots and
+    only overwrites a slot with a search at least as deep.
+    """
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, size=100000, replacement='lru'):
+        if replacement not in ('lru', 'depth'):
+            raise Exception('Unknown transposition table replacement: ' + str(replacement))
+        self.size = size
+        self.replacement = replacement
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict() if self.replacement == 'lru' else [None] * self.size
+        self.probes = 0
+        self.hits = 0
+
+    def lookup(self, key):
+        self.probes += 1
+        if self.replacement == 'lru':
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        else:
+            slot = self.entries[hash(key) % self.size]
+            entry = slot[1] if slot is not None and slot[0] == key else None
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def store(self, key, depth, flag, value, move):
+        entry = (depth, flag, value, move)
+        if self.replacement == 'lru':
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            index = hash(key) % self.size
+            slot = self.entries[index]
+            if slot is None or slot[0] == key or depth >= slot[1][0]:
+                self.entries[index] = (key, entry)
+
+    def __len__(self):
+        if self.replacement == 'lru':
+            return len(self.entries)
+        return len(self.entries) - self.entries.count(None)
+
+_WORKER_AGENT = None
+
+def _initSearchWorker(agent):
+    global _WORKER_AGENT
+    _WORKER_AGENT = agent
+
+def _searchSubtree(method, args):
+    """ Runs one subtree search in a worker process, returning (value, search counters). """
+    if hasattr(_WORKER_AGENT, 'startSearch'):
+        _WORKER_AGENT.startSearch()
+    value = getattr(_WORKER_AGENT, method)(*args)[0]
+    return value, getattr(_WORKER_AGENT, 'searchStats', {})
+
 class MultiAgentSearchAgent(Agent):
     """
     This class provides common elements to all multi-agent searchers.
+
+    Passing tt=1 (e.g. -a tt=1,ttSize=200000,ttReplace=depth) gives the agent
+    a TranspositionTable.  Values are stored relative to the state's score,
+    so an entry is reused whenever the same position comes up again, even
+    with a different score, for any evaluation function of the form
+    score + f(position).
+
+    Passing workers=N searches the subtree under each root action in a pool
+    of N processes, each holding its own copy of the agent; the pool is
+    started on the first search of a game and shut down by final.
+
+    Passing batch=1 scores the sibling leaves of each last-ply node with one
+    call to the evaluation function's evaluateBatch(states), if it has one,
+    instead of one call per leaf.
+
+    Agents that search against the clock take their per-move and per-game
+    limits from registerTimeLimits; moveBudget turns them into the seconds
+    available for the next move.  The share of the game limit never drops
+    below minBudget until safety times the limit is used up, and is 0 after.
     """
-    def __init__(self, evalFn='scoreEvaluationFunction', depth='3'):
+    def __init__(self, evalFn='scoreEvaluationFunction', depth='3', tt='0', ttSize='100000', ttReplace='lru', workers='0', batch='0'):
         self.index = 0 
         self.evaluationFunction = util.lookup(evalFn, globals())
+        if int(batch) and 'evaluateBatch' in dir(self.evaluationFunction):
+            self.evaluateBatch = self.evaluationFunction.evaluateBatch
+        else:
+            self.evaluateBatch = None
         self.depth = int(depth)
+        self.transpositionTable = TranspositionTable(int(ttSize), ttReplace) if int(tt) else None
+        self.workers = int(workers)
+        self.executor = None
+        self.timeLimit = None
+        self.safety = 0.75
+        self.totalShare = 0.1
+        self.minBudget = 0.05
+        self.moveTimeout = None
+        self.totalTimeout = None
+        self.timeUsed = 0.0
+
+    def registerTimeLimits(self, moveTime, totalTime):
+        self.moveTimeout = moveTime
+        self.totalTimeout = totalTime
+        self.timeUsed = 0.0
+
+    def moveBudget(self):
+        """ Seconds available for one move, or None if unlimited. """
+        budgets = []
+        if self.moveTimeout is not None:
+            budgets.append(self.safety * self.moveTimeout)
+        if self.totalTimeout is not None:
+            # Past the safety line only the minimum search (e.g. depth 1) is left
+            left = self.safety * self.totalTimeout - self.timeUsed
+            budgets.append(max(self.minBudget, self.totalShare * left) if left > 0 else 0.0)
+        if self.timeLimit is not None:
+            budgets.append(self.timeLimit)
+        return min(budgets) if budgets else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+    def getExecutor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_initSearchWorker, initargs=(self,))
+        return self.executor
+
+    def final(self, gameState: GameState):
+        """ Shuts down the worker processes at the end of each game. """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def useWorkers(self, gameState: GameState):
+        """ Whether to split this root search across worker processes. """
+        return self.workers > 1 and gameState.getNumAgents() > 1 and len(gameState.getLegalActions(0)) > 1
+
+    def parallelRootAction(self, gameState: GameState, method):
+        """
+        Searches the subtree under each legal Pacman action in a worker and,
+        like the serial search, returns the first action with the best value.
+        """
+        legalMoves = gameState.getLegalActions(0)
+        futures = [self.getExecutor().submit(_searchSubtree, method, (self.successor(gameState, 0, action), 1, self.depth, 1))
+                   for action in legalMoves]
+        scores = [future.result()[0] for future in futures]
+        return legalMoves[scores.index(max(scores))]
+
+    def registerInitialState(self, gameState: GameState):
+        if self.transpositionTable is not None:
+            self.transpositionTable.clear()
+
+    def successor(self, gameState: GameState, agentIndex, action):
+        """
+        generateSuccessor for an action the search took from getLegalActions,
+        so a GameState can skip checking it again.
+        """
+        if getattr(type(gameState), 'trustedSuccessors', False):
+            return gameState.generateSuccessor(agentIndex, action, trusted=True)
+        return gameState.generateSuccessor(agentIndex, action)
+
+    def evaluateLeaves(self, states):
+        """ Scores a list of sibling leaf states, in one batch when batch mode is on. """
+        if self.evaluateBatch is not None:
+            return self.evaluateBatch(states)
+        return [self.evaluationFunction(state) for state in states]
+
+    def remainingPlies(self, currentDepth, targetDepth, agentIndex, numAgents):
+        """ Number of plies left below a node, counting one per agent move. """
+        return (targetDepth - currentDepth) * numAgents + numAgents - agentIndex
+
+    def lookup(self, gameState: GameState, agentIndex):
+        """ Returns the (plies, flag, value, move) entry stored for a node, or None. """
+        if self.transpositionTable is None:
+            return None
+        entry = self.transpositionTable.lookup((gameState.key(), agentIndex))
+        if entry is None:
+            return None
+        return entry[0], entry[1], entry[2] + gameState.getScore(), entry[3]
+
+    def probe(self, gameState: GameState, agentIndex, plies):
+        """ Returns a (flag, value, move) entry searched at least plies deep, or None. """
+        entry = self.lookup(gameState, agentIndex)
+        if entry is None or entry[0] < plies:
+            return None
+        return entry[1:]
+
+    def record(self, gameState: GameState, agentIndex, plies, value, move, flag=TranspositionTable.EXACT):
+        if self.transpositionTable is not None:
+            self.transpositionTable.store((gameState.key(), agentIndex), plies, flag, value - gameState.getScore(), move)
 
 class MinimaxAgent(MultiAgentSearchAgent):
     """ Your minimax agent """
     def getAction(self, gameState: GameState):
+        if self.useWorkers(gameState):
+            return self.parallelRootAction(gameState, 'minimax')
         return self.minimax(gameState, 1, self.depth, 0)[1]
 
     def minimax(self, gameState: GameState, currentDepth, targetDepth, agentIndex):
         if gameState.isWin() or gameState.isLose():
             return self.evaluationFunction(gameState), "STOP"
-        
-        if currentDepth == targetDepth and agentIndex == gameState.getNumAgents() - 1:
-            legalMoves = gameState.getLegalActions(agentIndex)
-            scores = [self.evaluationFunction(gameState.generateSuccessor(agentIndex, action)) for action in legalMoves]
-            return min(scores), random.choice(legalMoves)
-        
+
+        numAgents = gameState.getNumAgents()
+        plies = self.remainingPlies(currentDepth, targetDepth, agentIndex, numAgents)
+        entry = self.probe(gameState, agentIndex, plies)
+        if entry is not None:
+            return entry[1], entry[2]
+
         legalMoves = gameState.getLegalActions(agentIndex)
-        if agentIndex == 0:
-            scores = [self.minimax(gameState.generateSuccessor(agentIndex, action), currentDepth, targetDepth, agentIndex + 1)[0] for action in legalMoves]
-            return max(scores), random.choice(legalMoves)
+        if currentDepth == targetDepth and agentIndex == numAgents - 1:
+            scores = self.evaluateLeaves([self.successor(gameState, agentIndex, action) for action in legalMoves])
+            bestScore = min(scores)
+        elif agentIndex == 0:
+            scores = [self.minimax(self.successor(gameState, agentIndex, action), currentDepth, targetDepth, agentIndex + 1)[0] for action in legalMoves]
+            bestScore = max(scores)
         else:
-            scores = [self.minimax(gameState.generateSuccessor(agentIndex, action), currentDepth + (agentIndex == gameState.getNumAgents() - 1), targetDepth, (agentIndex + 1) % gameState.getNumAgents())[0] for action in legalMoves]
-            return min(scores), random.choice(legalMoves)
+            scores = [self.minimax(self.successor(gameState, agentIndex, action), currentDepth + (agentIndex == numAgents - 1), targetDepth, (agentIndex + 1) % numAgents)[0] for action in legalMoves]
+            bestScore = min(scores)
+        bestMove = legalMoves[scores.index(bestScore)]
+        self.record(gameState, agentIndex, plies, bestScore, bestMove)
+        return bestScore, bestMove
+
+class MoveOrderer:
+    """
+    Orders the moves tried at an alpha-beta node using any combination of
+
+      killer  - the last two moves that caused a cutoff at the same ply
+      history - moves that caused cutoffs for the agent from the same square,
+                weighted by the number of plies they saved
+      static  - Pacman moves onto or toward the closest food first, ghosts
+                move toward Pacman first (away from him while scared)
+
+    Killers are tried before history, history before static order, and the
+    transposition table's best move before all of them.  Python's stable
+    sort keeps getLegalActions order among equally ranked moves.
+    """
+    HEURISTICS = ('killer', 'history', 'static')
+
+    def __init__(self, heuristics):
+        for heuristic in heuristics:
+            if heuristic not in MoveOrderer.HEURISTICS:
+                raise Exception('Unknown move ordering heuristic: ' + heuristic)
+        self.useKillers = 'killer' in heuristics
+        self.useHistory = 'history' in heuristics
+        self.useStatic = 'static' in heuristics
+        self.killers = {}
+        self.history = util.Counter()
+
+    def newSearch(self):
+        """ Forgets killers, whose plies refer to the old root, and ages history. """
+        self.killers = {}
+        for key in list(self.history.keys()):
+            self.history[key] //= 2
+
+    def order(self, gameState: GameState, agentIndex, legalMoves, ply, hashMove):
+        killers = self.killers.get(ply, ()) if self.useKillers else ()
+        position = gameState.data.agentStates[agentIndex].getPosition()
+        static = self.staticScores(gameState, agentIndex, legalMoves) if self.useStatic else None
+        def rank(i):
+            move = legalMoves[i]
+            return (move != hashMove,
+                    killers.index(move) if move in killers else len(killers),
+                    -self.history[(agentIndex, position, move)] if self.useHistory else 0,
+                    static[i] if static is not None else 0)
+        return [legalMoves[i] for i in sorted(range(len(legalMoves)), key=rank)]
+
+    def staticScores(self, gameState: GameState, agentIndex, legalMoves):
+        """ Lower is tried first. """
+        x, y = gameState.data.agentStates[agentIndex].getPosition()
+        vectors = [Actions.directionToVector(move) for move in legalMoves]
+        if agentIndex == 0:
+            food = gameState.data.foodPositions
+            if not food:
+                return [0] * len(legalMoves)
+            target = min(food, key=lambda f: abs(f[0] - x) + abs(f[1] - y))
+            return [-2 if (x + dx, y + dy) in food else abs(target[0] - x - dx) + abs(target[1] - y - dy)
+                    for dx, dy in vectors]
+        px, py = gameState.getPacmanPosition()
+        sign = -1 if gameState.data.agentStates[agentIndex].scaredTimer > 0 else 1
+        return [sign * (abs(px - x - dx) + abs(py - y - dy)) for dx, dy in vectors]
+
+    def cutoff(self, agentIndex, position, move, ply, plies):
+        if self.useKillers:
+            killers = self.killers.setdefault(ply, [])
+            if move not in killers:
+                killers.insert(0, move)
+                del killers[2:]
+        if self.useHistory:
+            self.history[(agentIndex, position, move)] += plies * plies
 
 class AlphaBetaAgent(MultiAgentSearchAgent):
-    """ Your alpha-beta pruning agent """
+    """
+    Your alpha-beta pruning agent
+
+    ordering takes '+'-separated MoveOrderer heuristics, e.g.
+    -a ordering=killer+history+static.  searchStats counts the nodes visited,
+    successors generated and cutoffs of the last move (totalSearchStats over
+    the game) so orderings can be compared; stats=1 prints the totals when
+    the game ends.
+    """
+    def __init__(self, evalFn='scoreEvaluationFunction', depth='3', tt='0', ttSize='100000', ttReplace='lru', workers='0', ordering='', stats='0', batch='0'):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, tt, ttSize, ttReplace, workers, batch)
+        heuristics = [h for h in str(ordering).split('+') if h]
+        self.moveOrderer = MoveOrderer(heuristics) if heuristics else None
+        self.printStats = bool(int(stats))
+        self.searchStats = util.Counter()
+        self.totalSearchStats = util.Counter()
+
+    def registerInitialState(self, gameState: GameState):
+        MultiAgentSearchAgent.registerInitialState(self, gameState)
+        self.searchStats = util.Counter()
+        self.totalSearchStats = util.Counter()
+
     def getAction(self, gameState: GameState):
+        self.startSearch()
+        if self.useWorkers(gameState):
+            return self.parallelAlphaBeta(gameState)
         return self.alphabeta(gameState, 1, self.depth, 0, -math.inf, math.inf)[1]
 
+    def parallelAlphaBeta(self, gameState: GameState):
+        """
+        Young brothers wait: the first root action is searched here with a full
+        window, then the others go to the workers, each with the best value
+        known when it is sent as alpha.  Values above alpha are exact and the
+        rest can never win, so this picks the same action as the serial
+        search over the same root move order.
+        """
+        entry = self.lookup(gameState, 0)
+        legalMoves = self.orderMoves(gameState, 0, gameState.getLegalActions(0), 0, entry[3] if entry is not None else None)
+        scores = [self.alphabeta(self.successor(gameState, 0, legalMoves[0]), 1, self.depth, 1, -math.inf, math.inf)[0]]
+        alpha = scores[0]
+        pending = {}
+        for i in range(1, len(legalMoves)):
+            if len(pending) == self.workers:
+                alpha = max(alpha, self.collectResult(pending, scores))
+            args = (self.successor(gameState, 0, legalMoves[i]), 1, self.depth, 1, alpha, math.inf)
+            pending[self.getExecutor().submit(_searchSubtree, 'alphabeta', args)] = i
+            scores.append(None)
+        while pending:
+            self.collectResult(pending, scores)
+        bestScore = max(scores)
+        return legalMoves[scores.index(bestScore)]
+
+    def collectResult(self, pending, scores):
+        """ Waits for one pending subtree search, filling in its score. """
+        done = wait(pending, return_when=FIRST_COMPLETED)[0]
+        future = done.pop()
+        score, stats = future.result()
+        scores[pending.pop(future)] = score
+        for key, value in stats.items():
+            self.searchStats[key] += value
+        return score
+
+    def startSearch(self):
+        self.tallySearchStats()
+        if self.moveOrderer is not None:
+            self.moveOrderer.newSearch()
+
+    def tallySearchStats(self):
+        for key, value in self.searchStats.items():
+            self.totalSearchStats[key] += value
+        self.searchStats = util.Counter()
+
+    def final(self, gameState: GameState):
+        MultiAgentSearchAgent.final(self, gameState)
+        self.tallySearchStats()
+        if self.printStats:
+            stats = self.totalSearchStats
+            print('Search: %d nodes, %d successors generated, %d cutoffs (%d on the first move)' % (
+                stats['nodes'], stats['generated'], stats['cutoffs'], stats['firstMoveCutoffs']))
+
     def alphabeta(self, gameState: GameState, currentDepth, targetDepth, agentIndex, alpha, beta):
+        self.searchStats['nodes'] += 1
         if gameState.isWin() or gameState.isLose():
             return self.evaluationFunction(gameState), "STOP"
-        
-        if currentDepth == targetDepth and agentIndex == gameState.getNumAgents() - 1:
+
+        numAgents = gameState.getNumAgents()
+        plies = self.remainingPlies(currentDepth, targetDepth, agentIndex, numAgents)
+        entry = self.lookup(gameState, agentIndex)
+        hashMove = None
+        if entry is not None:
+            storedPlies, flag, value, hashMove = entry
+            if storedPlies >= plies:
+                if flag == TranspositionTable.EXACT:
+                    return value, hashMove
+                if flag == TranspositionTable.LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if beta <= alpha:
+                    return value, hashMove
+        window = alpha, beta
+
+        if currentDepth == targetDepth and agentIndex == numAgents - 1:
             legalMoves = gameState.getLegalActions(agentIndex)
-            scores = [self.evaluationFunction(gameState.generateSuccessor(agentIndex, action)) for action in legalMoves]
-            return min(scores), random.choice(legalMoves)
-        
-        legalMoves = gameState.getLegalActions(agentIndex)
+            self.searchStats['generated'] += len(legalMoves)
+            scores = self.evaluateLeaves([self.successor(gameState, agentIndex, action) for action in legalMoves])
+            bestScore = min(scores)
+            bestMove = legalMoves[scores.index(bestScore)]
+            self.record(gameState, agentIndex, plies, bestScore, bestMove)
+            return bestScore, bestMove
+
+        ply = (currentDepth - 1) * numAgents + agentIndex
+        legalMoves = self.orderMoves(gameState, agentIndex, gameState.getLegalActions(agentIndex), ply, hashMove)
         if agentIndex == 0:
             bestScore = -math.inf
             bestMove = None
-            for action in legalMoves:
-                score = self.alphabeta(gameState.generateSuccessor(agentIndex, action), currentDepth, targetDepth, agentIndex + 1, alpha, beta)[0]
+            for i, action in enumerate(legalMoves):
+                self.searchStats['generated'] += 1
+                score = self.alphabeta(self.successor(gameState, agentIndex, action), currentDepth, targetDepth, agentIndex + 1, alpha, beta)[0]
                 if score > bestScore:
                     bestScore = score
                     bestMove = action
                 alpha = max(alpha, bestScore)
                 if beta <= alpha:
+                    self.recordCutoff(gameState, agentIndex, action, ply, plies, i)
                     break
-            return bestScore, bestMove
         else:
             bestScore = math.inf
             bestMove = None
-            for action in legalMoves:
-                score = self.alphabeta(gameState.generateSuccessor(agentIndex, action), currentDepth + (agentIndex == gameState.getNumAgents() - 1), targetDepth, (agentIndex + 1) % gameState.getNumAgents(), alpha, beta)[0]
+            for i, action in enumerate(legalMoves):
+                self.searchStats['generated'] += 1
+                score = self.alphabeta(self.successor(gameState, agentIndex, action), currentDepth + (agentIndex == numAgents - 1), targetDepth, (agentIndex + 1) % numAgents, alpha, beta)[0]
                 if score < bestScore:
                     bestScore = score
                     bestMove = action
                 beta = min(beta, bestScore)
                 if beta <= alpha:
+                    self.recordCutoff(gameState, agentIndex, action, ply, plies, i)
                     break
-            return bestScore, bestMove
+        self.record(gameState, agentIndex, plies, bestScore, bestMove, self.boundFlag(bestScore, *window))
+        return bestScore, bestMove
+
+    def orderMoves(self, gameState: GameState, agentIndex, legalMoves, ply, hashMove):
+        """
+        Returns legalMoves in the order alpha-beta should try them.  ply counts
+        agent moves from the root and hashMove is the best move stored in the
+        transposition table for this node, if any.
+        """
+        if self.moveOrderer is None:
+            return legalMoves
+        return self.moveOrderer.order(gameState, agentIndex, legalMoves, ply, hashMove)
+
+    def recordCutoff(self, gameState: GameState, agentIndex, move, ply, plies, moveNumber):
+        self.searchStats['cutoffs'] += 1
+        if moveNumber == 0:
+            self.searchStats['firstMoveCutoffs'] += 1
+        if self.moveOrderer is not None:
+            self.moveOrderer.cutoff(agentIndex, gameState.data.agentStates[agentIndex].getPosition(), move, ply, plies)
+
+    def boundFlag(self, score, alpha, beta):
+        """ Classifies a score returned for the window (alpha, beta). """
+        if score <= alpha:
+            return TranspositionTable.UPPER
+        if score >= beta:
+            return TranspositionTable.LOWER
+        return TranspositionTable.EXACT
+
+class SearchTimeout(Exception):
+    """ Raised inside a search when its time budget runs out. """
+    pass
+
+class IterativeDeepeningAlphaBetaAgent(AlphaBetaAgent):
+    """
+    Alpha-beta search run at depth 1, 2, 3, ... until the per-move time budget
+    is nearly spent, returning the move of the deepest completed search.
+    Depth 1 always runs to completion, whatever the budget.
+
+    The game rules register a per-move and a per-game limit through
+    registerTimeLimits.  A move may use safety times the per-move limit, but
+    no more than totalShare of what is left of safety times the game limit
+    (when the game enforces one), and no more than timeLimit seconds.  Each
+    iteration tries the previous iteration's principal variation first and
+    then the transposition table's best move, which is always enabled here.
+    workers is not supported.
+    """
+    def __init__(self, evalFn='scoreEvaluationFunction', depth='100', timeLimit='1', safety='0.75', totalShare='0.1', ttSize='100000', ttReplace='lru', ordering='', stats='0', batch='0'):
+        AlphaBetaAgent.__init__(self, evalFn, depth, '1', ttSize, ttReplace, '0', ordering, stats, batch)
+        self.timeLimit = float(timeLimit) if timeLimit is not None else None
+        self.safety = float(safety)
+        self.totalShare = float(totalShare)
+        self.deadline = None
+        self.principalVariation = []
+        self.pvMoves = {}
+        self.completedDepth = 0
+
+    def getAction(self, gameState: GameState):
+        start = time.time()
+        self.startSearch()
+        budget = self.moveBudget()
+        self.deadline = start + budget if budget is not None else None
+        self.completedDepth = 0
+        for depth in range(1, self.depth + 1):
+            try:
+                bestMove = self.alphabeta(gameState, 1, depth, 0, -math.inf, math.inf)[1]
+            except SearchTimeout:
+                break
+            self.completedDepth = depth
+            self.principalVariation = self.extractPrincipalVariation(gameState, depth)
+            self.pvMoves = dict(self.principalVariation)
+        self.deadline = None
+        self.timeUsed += time.time() - start
+        return bestMove
+
+    def alphabeta(self, gameState: GameState, currentDepth, targetDepth, agentIndex, alpha, beta):
+        if targetDepth > 1 and self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout()
+        return AlphaBetaAgent.alphabeta(self, gameState, currentDepth, targetDepth, agentIndex, alpha, beta)
+
+    def extractPrincipalVariation(self, gameState: GameState, depth):
+        """
+        Follows the transposition table's best moves from gameState, returning
+        the line as ((state key, agent index), move) pairs.
+        """
+        line = []
+        agentIndex = 0
+        for ply in range(depth * gameState.getNumAgents()):
+            if gameState.isWin() or gameState.isLose():
+                break
+            entry = self.lookup(gameState, agentIndex)
+            if entry is None or entry[3] not in gameState.getLegalActions(agentIndex):
+                break
+            line.append(((gameState.key(), agentIndex), entry[3]))
+            gameState = self.successor(gameState, agentIndex, entry[3])
+            agentIndex = (agentIndex + 1) % gameState.getNumAgents()
+        return line
+
+    def orderMoves(self, gameState: GameState, agentIndex, legalMoves, ply, hashMove):
+        legalMoves = AlphaBetaAgent.orderMoves(self, gameState, agentIndex, legalMoves, ply, hashMove)
+        first = [self.pvMoves.get((gameState.key(), agentIndex)), hashMove]
+        first = [move for i, move in enumerate(first) if move in legalMoves and move not in first[:i]]
+        return first + [move for move in legalMoves if move not in first]
 
 class ExpectimaxAgent(MultiAgentSearchAgent):
-    """ Your expectimax agent """
+    """
+    Your expectimax agent
+
+    By default every ghost action is expanded and averaged uniformly.  Passing
+    ghost=DirectionalGhost weights the ghost actions by that ghost model's
+    getDistribution instead, and samples=k (e.g. -a depth=3,samples=2) expands
+    only k actions drawn from the model at each chance node (RandomGhost
+    unless ghost is given), which keeps deep searches against many ghosts
+    affordable.  Chance-node values are cached by state for the duration of a
+    move unless chanceCache=0.
+    """
+    def __init__(self, evalFn='scoreEvaluationFunction', depth='3', tt='0', ttSize='100000', ttReplace='lru', workers='0', samples='0', ghost=None, chanceCache='1', batch='0'):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, tt, ttSize, ttReplace, workers, batch)
+        self.samples = int(samples)
+        if ghost is None and self.samples:
+            ghost = 'RandomGhost'
+        self.ghostModel = util.lookup(ghost, vars(ghostAgents)) if ghost is not None else None
+        self.ghostModels = {}
+        self.chanceValues = {} if int(chanceCache) else None
+
+    def startSearch(self):
+        if self.chanceValues is not None:
+            self.chanceValues.clear()
+
     def getAction(self, gameState: GameState):
+        self.startSearch()
+        if self.useWorkers(gameState):
+            return self.parallelRootAction(gameState, 'expectimax')
         return self.expectimax(gameState, 1, self.depth, 0)[1]
 
+    def chanceOutcomes(self, gameState: GameState, agentIndex, legalMoves):
+        """ Returns the (action, weight) pairs a chance node averages over. """
+        if self.ghostModel is None:
+            return [(action, 1.0 / len(legalMoves)) for action in legalMoves]
+        if agentIndex not in self.ghostModels:
+            self.ghostModels[agentIndex] = self.ghostModel(agentIndex)
+        distribution = self.ghostModels[agentIndex].getDistribution(gameState)
+        if not self.samples or self.samples >= len(legalMoves):
+            return [(action, distribution[action]) for action in legalMoves if distribution[action] > 0]
+        counts = util.Counter()
+        for _ in range(self.samples):
+            counts[util.sample(distribution)] += 1
+        return [(action, counts[action] / self.samples) for action in legalMoves if counts[action]]
+
     def expectimax(self, gameState: GameState, currentDepth, targetDepth, agentIndex):
         if gameState.isWin() or gameState.isLose():
             return self.evaluationFunction(gameState), "STOP"
-        
-        if currentDepth == targetDepth and agentIndex == gameState.getNumAgents() - 1:
-            legalMoves = gameState.getLegalActions(agentIndex)
-            scores = [self.evaluationFunction(gameState.generateSuccessor(agentIndex, action)) for action in legalMoves]
-            return sum(scores) / len(scores), random.choice(legalMoves)
-        
+
+        numAgents = gameState.getNumAgents()
+        plies = self.remainingPlies(currentDepth, targetDepth, agentIndex, numAgents)
+        entry = self.probe(gameState, agentIndex, plies)
+        if entry is not None:
+            return entry[1], entry[2]
+        cacheKey = (gameState, agentIndex, plies)
+        if agentIndex > 0 and self.chanceValues is not None and cacheKey in self.chanceValues:
+            return self.chanceValues[cacheKey], None
+
         legalMoves = gameState.getLegalActions(agentIndex)
-        if agentIndex == 0:
-            scores = [self.expectimax(gameState.generateSuccessor(agentIndex, action), currentDepth, targetDepth, agentIndex + 1)[0] for action in legalMoves]
-            return max(scores), random.choice(legalMoves)
+        if agentIndex == 0 and not (currentDepth == targetDepth and numAgents == 1):
+            scores = [self.expectimax(self.successor(gameState, agentIndex, action), currentDepth, targetDepth, agentIndex + 1)[0] for action in legalMoves]
+            bestScore = max(scores)
+            result = bestScore, legalMoves[scores.index(bestScore)]
+        else:
+            if currentDepth == targetDepth and agentIndex == numAgents - 1:
+                values = self.evaluateLeaves
+            else:
+                values = lambda states: [self.expectimax(state, currentDepth + (agentIndex == numAgents - 1), targetDepth, (agentIndex + 1) % numAgents)[0] for state in states]
+            if self.ghostModel is None or agentIndex == 0:
+                scores = values([self.successor(gameState, agentIndex, action) for action in legalMoves])
+                result = sum(scores) / len(scores), None
+            else:
+                outcomes = self.chanceOutcomes(gameState, agentIndex, legalMoves)
+                total = sum(weight for action, weight in outcomes)
+                scores = values([self.successor(gameState, agentIndex, action) for action, weight in outcomes])
+                result = sum(weight * score for (action, weight), score in zip(outcomes, scores)) / total, None
+            if agentIndex > 0 and self.chanceValues is not None:
+                self.chanceValues[cacheKey] = result[0]
+        self.record(gameState, agentIndex, plies, *result)
+        return result
+
+class MCTSNode:
+    """
+    A Pacman decision node of the MCTS tree.  Each tried action leads to an
+    MCTSChanceNode whose children are the states the ghosts' replies led to.
+    """
+    def __init__(self, gameState: GameState):
+        self.state = gameState
+        self.visits = 0
+        self.children = {}
+        self.untried = None
+
+class MCTSChanceNode:
+    """ Statistics of one Pacman action, with its outcomes keyed by state. """
+    def __init__(self):
+        self.visits = 0
+        self.total = 0.0
+        self.outcomes = {}
+
+class MCTSAgent(MultiAgentSearchAgent):
+    """
+    Monte Carlo tree search (UCT) over Pacman's moves.
+
+    Every iteration walks down the tree choosing Pacman actions by UCB1 and
+    letting the ghosts reply with a ghost model (ghost=RandomGhost or
+    DirectionalGhost), adds one new node, then plays a rollout of at most
+    rolloutDepth Pacman moves with random Pacman moves and the same ghost
+    model, scoring its end with the evaluation function.  A move runs
+    iterations iterations, stopping early after timeLimit seconds or when the
+    game's registered time limits would be exceeded (see moveBudget), though
+    never before minIterations, and plays the most visited action.  With reuse=1 the subtree of the state
+    actually reached is kept as the next move's root.
+    """
+    def __init__(self, evalFn='scoreEvaluationFunction', iterations='1000', timeLimit=None, rolloutDepth='20', exploration='1.4', ghost='RandomGhost', reuse='1', safety='0.75', totalShare='0.1', minIterations='20'):
+        MultiAgentSearchAgent.__init__(self, evalFn)
+        self.iterations = int(iterations)
+        self.minIterations = min(int(minIterations), self.iterations)
+        self.timeLimit = float(timeLimit) if timeLimit is not None else None
+        self.rolloutDepth = int(rolloutDepth)
+        self.exploration = float(exploration)
+        self.ghostModel = util.lookup(ghost, vars(ghostAgents))
+        self.ghostAgents = {}
+        self.reuse = int(reuse)
+        self.safety = float(safety)
+        self.totalShare = float(totalShare)
+        self.root = None
+        self.lastMove = None
+        self.iterationsRun = 0
+
+    def registerInitialState(self, gameState: GameState):
+        MultiAgentSearchAgent.registerInitialState(self, gameState)
+        self.root = None
+        self.lastMove = None
+
+    def getAction(self, gameState: GameState):
+        start = time.time()
+        budget = self.moveBudget()
+        deadline = start + budget if budget is not None else None
+        root = self.findRoot(gameState)
+        self.iterationsRun = 0
+        while self.iterationsRun < self.iterations:
+            if self.iterationsRun >= self.minIterations and deadline is not None and time.time() > deadline:
+                break
+            self.iterate(root)
+            self.iterationsRun += 1
+        if root.children:
+            bestMove = max(root.children, key=lambda action: root.children[action].visits)
         else:
-            scores = [self.expectimax(gameState.generateSuccessor(agentIndex, action), currentDepth + (agentIndex == gameState.getNumAgents() - 1), targetDepth, (agentIndex + 1) % gameState.getNumAgents())[0] for action in legalMoves]
-            return sum(scores) / len(scores), random.choice(legalMoves)
+            bestMove = gameState.getLegalActions(0)[0]
+        self.root = root if self.reuse else None
+        self.lastMove = bestMove
+        self.timeUsed += time.time() - start
+        return bestMove
+
+    def findRoot(self, gameState: GameState):
+        """ Returns the kept node for gameState, or a fresh one. """
+        if self.root is not None and self.lastMove in self.root.children:
+            node = self.root.children[self.lastMove].outcomes.get(gameState)
+            if node is not None:
+                return node
+        return MCTSNode(gameState)
+
+    def ghostAgent(self, agentIndex):
+        if agentIndex not in self.ghostAgents:
+            self.ghostAgents[agentIndex] = self.ghostModel(agentIndex)
+        return self.ghostAgents[agentIndex]
+
+    def ghostReplies(self, gameState: GameState):
+        """ Plays one move for every ghost, stopping if the game ends. """
+        for agentIndex in range(1, gameState.getNumAgents()):
+            if gameState.isWin() or gameState.isLose():
+                break
+            gameState = self.successor(gameState, agentIndex, self.ghostAgent(agentIndex).getAction(gameState))
+        return gameState
+
+    def iterate(self, root: MCTSNode):
+        """ Runs one selection, expansion, rollout and backup pass. """
+        node = root
+        path = []
+        while True:
+            node.visits += 1
+            state = node.state
+            if state.isWin() or state.isLose():
+                value = self.evaluationFunction(state)
+                break
+            if node.untried is None:
+                node.untried = [action for action in state.getLegalActions(0) if action != Directions.STOP] or state.getLegalActions(0)
+                random.shuffle(node.untried)
+            if node.untried:
+                action = node.untried.pop()
+                node.children[action] = MCTSChanceNode()
+            else:
+                action = self.selectAction(node)
+            chance = node.children[action]
+            path.append(chance)
+            nextState = self.ghostReplies(self.successor(state, 0, action))
+            child = chance.outcomes.get(nextState)
+            if child is None:
+                child = chance.outcomes[nextState] = MCTSNode(nextState)
+                child.visits += 1
+                value = self.rollout(nextState)
+                break
+            node = child
+        for chance in path:
+            chance.visits += 1
+            chance.total += value
+
+    def selectAction(self, node: MCTSNode):
+        """ The UCB1 choice among node's actions, with their mean values scaled to [0, 1]. """
+        means = {action: chance.total / chance.visits for action, chance in node.children.items()}
+        low, high = min(means.values()), max(means.values())
+        logVisits = math.log(node.visits)
+        bestScore, bestAction = -math.inf, None
+        for action, chance in node.children.items():
+            exploit = (means[action] - low) / (high - low) if high > low else 0.5
+            score = exploit + self.exploration * math.sqrt(logVisits / chance.visits)
+            if score > bestScore:
+                bestScore, bestAction = score, action
+        return bestAction
+
+    def rollout(self, gameState: GameState):
+        for _ in range(self.rolloutDepth):
+            if gameState.isWin() or gameState.isLose():
+                break
+            legalMoves = [action for action in gameState.getLegalActions(0) if action != Directions.STOP] or gameState.getLegalActions(0)
+            gameState = self.ghostReplies(self.successor(gameState, 0, random.choice(legalMoves)))
+        return self.evaluationFunction(gameState)
 
 def betterEvaluationFunction(currentGameState: GameState):
     """
     A better evaluation function that considers both food and ghosts more comprehensively.
     """
     pacmanPosition = currentGameState.getPacmanPosition()
-    food = currentGameState.getFood()
     ghosts = currentGameState.getGhostStates()
     
     # Calculate food distance
-    foodDistances = [manhattanDistance(pacmanPosition, foodPosition) for foodPosition in food.asList()]
-    foodScore = -sum(foodDistances) if foodDistances else 0  # Sum of distances to all food
+    foodDistances = evaluationUtils.manhattanDistances(pacmanPosition, evaluationUtils.gridCoordinates(currentGameState.getFood()))
+    foodScore = -evaluationUtils.distanceSum(foodDistances)  # Sum of distances to all food
     
-    # Ghost evaluation (Pacman should avoid ghosts)
-    ghostScores = 0
-    for ghost, ghostDistance in zip(ghosts, [manhattanDistance(pacmanPosition, ghost.getPosition()) for ghost in ghosts]):
-        if ghost.scaredTimer > 0:
-            # Bonus for being near scared ghosts (Pacman can eat them)
-            ghostScores += 100 / (ghostDistance + 1) if ghostDistance <= 3 else 0
-        else:
-            # Penalize for being too close to non-scared ghosts
-            ghostScores -= 1000 / (ghostDistance + 1) if ghostDistance <= 3 else 0
+    # Ghost evaluation: a bonus near scared ghosts (Pacman can eat them), a penalty near the others
+    ghostDistances = evaluationUtils.manhattanDistances(pacmanPosition, evaluationUtils.positionCoordinates([ghost.getPosition() for ghost in ghosts]))
+    weights = [100 if ghost.scaredTimer > 0 else -1000 for ghost in ghosts]
+    ghostScores = evaluationUtils.sequentialSum(evaluationUtils.select(
+        lambda dist, weight: dist <= 3, lambda dist, weight: weight / (dist + 1), 0, ghostDistances, weights))
     
     # Combine the scores
     return currentGameState.getScore() + foodScore + ghostScores
 
+def betterEvaluationBatch(states):
+    """
+    betterEvaluationFunction for a list of states at once, giving the same
+    values.  Siblings usually share Pacman's position and food, so the food
+    term is computed once per distinct pair, and the ghost terms of all
+    states form one array.
+    """
+    if not evaluationUtils.available() or not states:
+        return [betterEvaluationFunction(state) for state in states]
+    foodScores = {}
+    scores = []
+    for state in states:
+        pacmanPosition = state.getPacmanPosition()
+        food = state.getFood()
+        if (pacmanPosition, food) not in foodScores:
+            foodDistances = evaluationUtils.manhattanDistances(pacmanPosition, evaluationUtils.gridCoordinates(food))
+            foodScores[(pacmanPosition, food)] = -evaluationUtils.distanceSum(foodDistances)
+        scores.append(state.getScore() + foodScores[(pacmanPosition, food)])
+    # Ghost terms of every state as one (states x agents) array, Pacman's column dropped
+    numAgents = states[0].getNumAgents()
+    agentStates = [state.data.agentStates for state in states]
+    xs, ys = evaluationUtils.positionCoordinates([agents[index].getPosition() for agents in agentStates for index in range(numAgents)])
+    ghostDistances = abs(xs - xs[::numAgents].repeat(numAgents)) + abs(ys - ys[::numAgents].repeat(numAgents))
+    weights = [100 if agents[index].scaredTimer > 0 else -1000 for agents in agentStates for index in range(numAgents)]
+    ghostTerms = evaluationUtils.select(lambda dist, weight: dist <= 3, lambda dist, weight: weight / (dist + 1), 0, ghostDistances, weights)
+    ghostTerms = ghostTerms.reshape(len(states), numAgents)[:, 1:].tolist()
+    # Each row is added left to right, like the single-state sum
+    return [score + evaluationUtils.sequentialSum(terms) for score, terms in zip(scores, ghostTerms)]
+
+betterEvaluationFunction.evaluateBatch = betterEvaluationBatch
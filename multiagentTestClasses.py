@@ -151,7 +151,7 @@ def run(lay, layName, pac, ghosts, disp, nGames=1, name='games'):
                             nGames, False, catchExceptions=True, timeout=120)
     print('*** Finished running %s on' % name, layName,
           'after %d seconds.' % (time.time() - starttime))
-    stats = {'time': time.time() - starttime, 'wins': [g.state.isWin() for g in games].count(True), 'games': games, 'scores': [g.state.getScore() for g in games],
+    stats = {'time': time.time() - starttime, 'wins': [g.win for g in games].count(True), 'games': games, 'scores': [g.score for g in games],
              'timeouts': [g.agentTimeout for g in games].count(True), 'crashes': [g.agentCrashed for g in games].count(True)}
     print('*** Won %d out of %d games. Average score: %f ***' %
           (stats['wins'], len(games), sum(stats['scores']) * 1.0 / len(games)))
@@ -180,6 +180,9 @@ class GradingAgent(Agent):
         self.seed = seed
 
     def registerInitialState(self, state):
+        # the number of expanded states is graded, so record them (the test
+        # turns this off again once its game is over)
+        GameState.trackExplored()
         if 'registerInitialState' in dir(self.studentAgent):
             self.studentAgent.registerInitialState(state)
         random.seed(self.seed)
@@ -288,6 +291,7 @@ class PolyAgent(Agent):
         return (ourpac, alternative_depth_pacs, partial_ply_bug_pacs)
 
     def registerInitialState(self, state):
+        GameState.trackExplored()
         for agent in self.solutionAgents + self.alternativeDepthAgents:
             if 'registerInitialState' in dir(agent):
                 agent.registerInitialState(state)
@@ -345,8 +349,11 @@ class PacmanGameTreeTest(testClasses.TestCase):
                            altDepthActions, partialPlyBugActions)
         # check return codes and assign grades
         disp = self.question.getDisplay()
-        stats = run(lay, self.layout_name, pac, [DirectionalGhost(
-            i + 1) for i in range(2)], disp, name=self.alg)
+        try:
+            stats = run(lay, self.layout_name, pac, [DirectionalGhost(
+                i + 1) for i in range(2)], disp, name=self.alg)
+        finally:
+            GameState.trackExplored(False)
         if stats['timeouts'] > 0:
             self.addMessage('Agent timed out on smallClassic.  No credit')
             return self.testFail(grades)
@@ -395,8 +402,11 @@ class PacmanGameTreeTest(testClasses.TestCase):
             ourPacOptions = {}
         pac = PolyAgent(self.seed, multiAgents, ourPacOptions, self.depth)
         disp = self.question.getDisplay()
-        run(lay, self.layout_name, pac, [DirectionalGhost(
-            i + 1) for i in range(2)], disp, name=self.alg)
+        try:
+            run(lay, self.layout_name, pac, [DirectionalGhost(
+                i + 1) for i in range(2)], disp, name=self.alg)
+        finally:
+            GameState.trackExplored(False)
         (optimalActions, altDepthActions, partialPlyBugActions) = pac.getTraces()
         # recover traces and record to file
         handle = open(filePath, 'w')
@@ -513,8 +523,8 @@ class EvalAgentTest(testClasses.TestCase):
                                 False, catchExceptions=True, timeout=self.maxTime)
         totalTime = time.time() - startTime
 
-        stats = {'time': totalTime, 'wins': [g.state.isWin() for g in games].count(True),
-                 'games': games, 'scores': [g.state.getScore() for g in games],
+        stats = {'time': totalTime, 'wins': [g.win for g in games].count(True),
+                 'games': games, 'scores': [g.score for g in games],
                  'timeouts': [g.agentTimeout for g in games].count(True), 'crashes': [g.agentCrashed for g in games].count(True)}
 
         averageScore = sum(stats['scores']) / float(len(stats['scores']))
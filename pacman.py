@@ -43,8 +43,11 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
+from game import BitGrid
+from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
+from gameRecords import packMoves, unpackMoves
 import util
 import layout
 import sys
@@ -72,15 +75,31 @@ class GameState:
 
     Note that in classic Pacman, Pacman is always agent 0.
     """
+    __slots__ = ('data',)
+
+    # generateSuccessor accepts trusted=True; checked on the class rather than
+    # by identity, since pacman.py run as a script defines __main__.GameState
+    trustedSuccessors = True
 
     ####################################################
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
-    explored = set()
+    # static variable keeps track of which states have been expanded by
+    # generateSuccessor; None (the default) while tracking is off
+    explored = None
+
+    def trackExplored(enabled=True):
+        """
+        Turns recording of expanded states on or off.  It is off by default,
+        since the set keeps every expanded state alive until it is reset.
+        """
+        GameState.explored = set() if enabled else None
+    trackExplored = staticmethod(trackExplored)
 
     def getAndResetExplored():
+        if GameState.explored is None:
+            return set()
         tmp = GameState.explored.copy()
         GameState.explored = set()
         return tmp
@@ -99,9 +118,12 @@ class GameState:
         else:
             return GhostRules.getLegalActions(self, agentIndex)
 
-    def generateSuccessor(self, agentIndex, action):
+    def generateSuccessor(self, agentIndex, action, trusted=False):
         """
         Returns the successor state after the specified agent takes the action.
+
+        trusted=True skips checking that the action is legal; only pass it for
+        actions taken from this state's getLegalActions(agentIndex).
         """
         # Check that successors exist
         if self.isWin() or self.isLose():
@@ -113,15 +135,15 @@ class GameState:
         # Let agent's logic deal with its action's effects on the board
         if agentIndex == 0:  # Pacman is moving
             state.data._eaten = [False for i in range(state.getNumAgents())]
-            PacmanRules.applyAction(state, action)
+            PacmanRules.applyAction(state, action, trusted)
         else:                # A ghost is moving
-            GhostRules.applyAction(state, action, agentIndex)
+            GhostRules.applyAction(state, action, agentIndex, trusted)
 
         # Time passes
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY  # Penalty for waiting around
         else:
-            GhostRules.decrementTimer(state.data.agentStates[agentIndex])
+            GhostRules.decrementTimer(state.data.copyAgentState(agentIndex))
 
         # Resolve multi-agent effects
         GhostRules.checkDeath(state, agentIndex)
@@ -129,8 +151,10 @@ class GameState:
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
+        state.data.updateKey()
+        if GameState.explored is not None:
+            GameState.explored.add(self)
+            GameState.explored.add(state)
         return state
 
     def getLegalPacmanActions(self):
@@ -176,6 +200,15 @@ class GameState:
     def getScore(self):
         return float(self.data.score)
 
+    def key(self):
+        """
+        Returns a compact, hashable key for this state, made of the food
+        bitmask, a capsule mask and the packed agent positions, directions
+        and scared timers.  Two states with equal keys differ at most in
+        score, so the key is suitable for transposition tables.
+        """
+        return self.data.key
+
     def getCapsules(self):
         """
         Returns a list of positions (x,y) of the remaining capsules.
@@ -183,7 +216,7 @@ class GameState:
         return self.data.capsules
 
     def getNumFood(self):
-        return self.data.food.count()
+        return self.data.numFood
 
     def getFood(self):
         """
@@ -230,13 +263,13 @@ class GameState:
         """
         Generates a new state by copying information from its predecessor.
         """
-        if prevState != None:  # Initial state
+        if prevState is not None:  # Initial state
             self.data = GameStateData(prevState.data)
         else:
             self.data = GameStateData()
 
     def deepCopy(self):
-        state = GameState(self)
+        state = GameState.__new__(GameState)
         state.data = self.data.deepCopy()
         return state
 
@@ -348,23 +381,22 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions(state.getPacmanState().configuration, state.data.layout.walls)
+        return list(state.data.layout.legalActions(state.data.agentStates[0].configuration)[0])
     getLegalActions = staticmethod(getLegalActions)
 
-    def applyAction(state, action):
+    def applyAction(state, action, trusted=False):
         """
-        Edits the state to reflect the results of the action.
+        Edits the state to reflect the results of the action, which is
+        checked for legality unless trusted.
         """
-        legal = PacmanRules.getLegalActions(state)
-        if action not in legal:
+        if not trusted and action not in PacmanRules.getLegalActions(state):
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.copyAgentState(0)
 
         # Update Configuration
-        vector = Actions.directionToVector(action, PacmanRules.PACMAN_SPEED)
-        pacmanState.configuration = pacmanState.configuration.generateSuccessor(
-            vector)
+        pacmanState.configuration = pacmanState.configuration.generateCodeSuccessor(
+            Directions.CODES[action], PacmanRules.PACMAN_SPEED)
 
         # Eat
         next = pacmanState.configuration.getPosition()
@@ -382,18 +414,23 @@ class PacmanRules:
             state.data.food = state.data.food.copy()
             state.data.food[x][y] = False
             state.data._foodEaten = position
-            # TODO: cache numFood?
-            numFood = state.getNumFood()
-            if numFood == 0 and not state.data._lose:
+            state.data.numFood -= 1
+            state.data.foodPositions = state.data.foodPositions - {position}
+            if isinstance(state.data.food, BitGrid):
+                state.data.food.setPositions(state.data.foodPositions)
+            if state.data.numFood == 0 and not state.data._lose:
                 state.data.scoreChange += 500
                 state.data._win = True
         # Eat capsule
         if(position in state.getCapsules()):
-            state.data.capsules.remove(position)
+            state.data.capsules = [
+                c for c in state.data.capsules if c != position]
+            state.data.capsuleMask &= ~(
+                1 << state.data.layout.capsules.index(position))
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range(1, len(state.data.agentStates)):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.copyAgentState(index).scaredTimer = SCARED_TIME
     consume = staticmethod(consume)
 
 
@@ -409,36 +446,27 @@ class GhostRules:
         reach a dead end, but can turn 90 degrees at intersections.
         """
         conf = state.getGhostState(ghostIndex).configuration
-        possibleActions = Actions.getPossibleActions(
-            conf, state.data.layout.walls)
-        reverse = Actions.reverseDirection(conf.direction)
-        if Directions.STOP in possibleActions:
-            possibleActions.remove(Directions.STOP)
-        if reverse in possibleActions and len(possibleActions) > 1:
-            possibleActions.remove(reverse)
-        return possibleActions
+        return list(state.data.layout.legalActions(conf)[1])
     getLegalActions = staticmethod(getLegalActions)
 
-    def applyAction(state, action, ghostIndex):
+    def applyAction(state, action, ghostIndex, trusted=False):
 
-        legal = GhostRules.getLegalActions(state, ghostIndex)
-        if action not in legal:
+        if not trusted and action not in GhostRules.getLegalActions(state, ghostIndex):
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.copyAgentState(ghostIndex)
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0:
             speed /= 2.0
-        vector = Actions.directionToVector(action, speed)
-        ghostState.configuration = ghostState.configuration.generateSuccessor(
-            vector)
+        ghostState.configuration = ghostState.configuration.generateCodeSuccessor(
+            Directions.CODES[action], speed)
     applyAction = staticmethod(applyAction)
 
     def decrementTimer(ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint(
-                ghostState.configuration.pos)
+            ghostState.configuration = Configuration.fromCode(nearestPoint(
+                ghostState.configuration.pos), ghostState.configuration.code)
         ghostState.scaredTimer = max(0, timer - 1)
     decrementTimer = staticmethod(decrementTimer)
 
@@ -449,12 +477,14 @@ class GhostRules:
                 ghostState = state.data.agentStates[index]
                 ghostPosition = ghostState.configuration.getPosition()
                 if GhostRules.canKill(pacmanPosition, ghostPosition):
-                    GhostRules.collide(state, ghostState, index)
+                    GhostRules.collide(
+                        state, state.data.copyAgentState(index), index)
         else:
             ghostState = state.data.agentStates[agentIndex]
             ghostPosition = ghostState.configuration.getPosition()
             if GhostRules.canKill(pacmanPosition, ghostPosition):
-                GhostRules.collide(state, ghostState, agentIndex)
+                GhostRules.collide(
+                    state, state.data.copyAgentState(agentIndex), agentIndex)
     checkDeath = staticmethod(checkDeath)
 
     def collide(state, ghostState, agentIndex):
@@ -463,6 +493,7 @@ class GhostRules:
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
             # Added for first-person
+            state.data._eaten = state.data._eaten[:]
             state.data._eaten[agentIndex] = True
         else:
             if not state.data._win:
@@ -541,9 +572,9 @@ def readCommand(argv):
     parser.add_option('-f', '--fixRandomSeed', action='store_true', dest='fixRandomSeed',
                       help='Fixes the random seed to always play the same game', default=False)
     parser.add_option('-r', '--recordActions', action='store_true', dest='record',
-                      help='Writes game histories to a file (named by the time they were played)', default=False)
+                      help='Writes game histories to a game record file (named by the time they were played)', default=False)
     parser.add_option('--replay', dest='gameToReplay',
-                      help='A recorded game file (pickle) to replay', default=None)
+                      help='A game record file whose games to replay', default=None)
     parser.add_option('-a', '--agentArgs', dest='agentArgs',
                       help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
     parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -554,12 +585,21 @@ def readCommand(argv):
                       help='Turns on exception handling and timeouts during games', default=False)
     parser.add_option('--timeout', dest='timeout', type='int',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--workers', dest='workers', type='int',
+                      help=default('Number of processes to spread quiet (-q) games across; 0 plays them in this process'), default=0)
+    parser.add_option('--verify-replays', dest='verifyReplays', metavar='DIR',
+                      help='Replays the games recorded in the game record files under DIR without agents and checks their scores (uses --workers processes, or one per CPU)', default=None)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
         raise Exception('Command line input not understood: ' + str(otherjunk))
     args = dict()
 
+    # Special case: verifying recordings plays no new games
+    if options.verifyReplays != None:
+        passed = verifyReplays(options.verifyReplays, options.workers or os.cpu_count())
+        sys.exit(0 if passed else 1)
+
     # Fix the random seed
     if options.fixRandomSeed:
         random.seed('cs188')
@@ -606,18 +646,17 @@ def readCommand(argv):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    if options.workers > 1:
+        if not options.quietGraphics:
+            raise Exception('--workers only runs games without graphics (-q)')
+        args['workers'] = options.workers
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
-        print('Replaying recorded game %s.' % options.gameToReplay)
-        import pickle
-        f = open(options.gameToReplay)
-        try:
-            recorded = pickle.load(f)
-        finally:
-            f.close()
-        recorded['display'] = args['display']
-        replayGame(**recorded)
+        print('Replaying recorded games %s.' % options.gameToReplay)
+        import gameRecords
+        for recorded in gameRecords.readGameRecords(options.gameToReplay):
+            replayGame(recorded.layout, recorded.getActions(), args['display'], recorded.numGhosts)
         sys.exit(0)
 
     return args
@@ -651,12 +690,14 @@ def loadAgent(pacman, nographics):
                     ' is not specified in any *Agents.py.')
 
 
-def replayGame(layout, actions, display):
+def replayGame(layout, actions, display, numGhosts=None):
     import pacmanAgents
     import ghostAgents
+    if numGhosts is None:
+        numGhosts = layout.getNumGhosts()
     rules = ClassicGameRules()
     agents = [pacmanAgents.GreedyAgent()] + [ghostAgents.RandomGhost(i+1)
-                                             for i in range(layout.getNumGhosts())]
+                                             for i in range(numGhosts)]
     game = rules.newGame(layout, agents[0], agents[1:], display)
     state = game.state
     display.initialize(state.data)
@@ -672,14 +713,197 @@ def replayGame(layout, actions, display):
     display.finish()
 
 
-def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, catchExceptions=False, timeout=30):
+def _verifyRecords(records):
+    """
+    Re-simulates recorded games through generateSuccessor, with no agents or
+    display, and returns (number of games, list of failures), a failure
+    being (game number, recorded score, replayed score or error message).
+    """
+    failures = []
+    for number, record in records:
+        state = GameState()
+        state.initialize(record.layout, record.numGhosts)
+        try:
+            for agentIndex, action in record.getActions():
+                state = state.generateSuccessor(agentIndex, action)
+            score = state.getScore()
+        except Exception as error:
+            score = '%s: %s' % (type(error).__name__, error)
+        if score != record.score:
+            failures.append((number, record.score, score))
+    return len(records), failures
+
+
+def verifyReplays(directory, workers, batchSize=256):
+    """
+    Replays every game in the game record files (*.rec) under directory
+    across workers processes and checks their final scores, printing any
+    mismatches and the throughput.  Returns whether every file could be read
+    and every game matched; files that cannot be read count as failures.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import collections
+    import gameRecords
+    if not os.path.isdir(directory):
+        print('No such directory: ' + directory)
+        return False
+    paths = sorted(os.path.join(root, name) for root, dirs, names in os.walk(directory)
+                   for name in names if name.endswith('.rec'))
+    if not paths:
+        print('No game record files (*.rec) in ' + directory)
+        return False
+    unreadable = []
+
+    def batches():
+        for path in paths:
+            batch = []
+            try:
+                for number, record in enumerate(gameRecords.readGameRecords(path)):
+                    batch.append((number + 1, record))
+                    if len(batch) == batchSize:
+                        yield path, batch
+                        batch = []
+            except Exception as e:
+                # The games read before the damage are still checked
+                print('%s: %s' % (path, e))
+                unreadable.append(path)
+            if batch:
+                yield path, batch
+
+    def report(path, future):
+        count, failures = future.result()
+        for number, recorded, replayed in failures:
+            print('%s game %d: recorded score %s, replayed %s' % (path, number, recorded, replayed))
+        return count, len(failures)
+
+    startTime = time.time()
+    numGames = 0
+    numFailures = 0
+    executor = ProcessPoolExecutor(workers)
+    try:
+        # Only a few batches are read ahead, and results are reported in order
+        pending = collections.deque()
+        for path, batch in batches():
+            if len(pending) >= 2 * workers:
+                count, failed = report(*pending.popleft())
+                numGames += count
+                numFailures += failed
+            pending.append((path, executor.submit(_verifyRecords, batch)))
+        while pending:
+            count, failed = report(*pending.popleft())
+            numGames += count
+            numFailures += failed
+    finally:
+        executor.shutdown()
+    elapsed = time.time() - startTime
+    print('Verified %d games from %d files in %.2f seconds (%.1f games/sec): %d mismatches, %d unreadable files' %
+          (numGames, len(paths), elapsed, numGames / max(elapsed, 1e-9), numFailures, len(unreadable)))
+    return numFailures == 0 and not unreadable
+
+
+class GameResult:
+    """
+    What runGames keeps of a finished game instead of the Game object, with
+    its final state, agents and output buffers: the score, whether Pacman
+    won, the number of moves, the game's running time in seconds, the
+    timeout and crash flags and, if kept, a zlib-compressed packMoves log
+    of the moves (see getActions), which crashed games do not keep.
+    """
+    __slots__ = ('score', 'win', 'moves', 'time', 'agentTimeout', 'agentCrashed', 'actionLog')
+
+    def __init__(self, game, time=0.0, keepActions=False):
+        self.score = game.state.getScore()
+        self.win = game.state.isWin()
+        self.moves = len(game.moveHistory)
+        self.time = time
+        self.agentTimeout = game.agentTimeout
+        self.agentCrashed = game.agentCrashed
+        self.actionLog = None
+        if keepActions and not game.agentCrashed:
+            import zlib
+            self.actionLog = zlib.compress(packMoves(game.moveHistory))
+
+    def getActions(self):
+        """ The game's (agentIndex, action) moves, or None if they were not kept. """
+        if self.actionLog is None:
+            return None
+        import zlib
+        return unpackMoves(zlib.decompress(self.actionLog))
+
+
+_WORKER_SETUP = None
+
+def _initGameWorker(*setup):
+    global _WORKER_SETUP
+    _WORKER_SETUP = setup
+
+
+def _playWorkerGame(index, seed):
+    """
+    Plays game number index in a worker process, seeding the random module
+    with seed first so the game does not depend on which worker plays it.
+    """
+    import textDisplay
+    layout, pacman, ghosts, catchExceptions, timeout, keepActions = _WORKER_SETUP
+    random.seed(seed)
+    rules = ClassicGameRules(timeout)
+    rules.quiet = True
+    game = rules.newGame(layout, pacman, ghosts,
+                         textDisplay.NullGraphics(), True, catchExceptions)
+    startTime = time.time()
+    game.run()
+    return GameResult(game, time.time() - startTime, keepActions)
+
+
+def runParallelGames(layout, pacman, ghosts, numGames, catchExceptions, timeout, workers, firstIndex=0, keepActions=False):
+    """
+    Plays numGames games without graphics across a pool of worker processes
+    and returns their GameResults in game order.  Game i is seeded from one
+    number drawn from the random module, so a run is reproducible under a
+    fixed seed (-f) whatever the number of workers, though it plays
+    different games than the same run in a single process.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    baseSeed = random.randrange(1 << 30)
+    indices = range(firstIndex, firstIndex + numGames)
+    executor = ProcessPoolExecutor(workers, initializer=_initGameWorker,
+                                   initargs=(layout, pacman, ghosts, catchExceptions, timeout, keepActions))
+    try:
+        return list(executor.map(_playWorkerGame, indices, [baseSeed + i for i in indices]))
+    finally:
+        executor.shutdown()
+
+
+def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, catchExceptions=False, timeout=30, workers=0, keepActions=False):
+    """
+    Plays numGames games, the first numTraining of them quietly, and prints a
+    summary of the rest, whose GameResults it returns (with their action logs
+    if keepActions is set).  If workers > 1 the non-training games are spread
+    across that many processes; training games are still played here, in
+    order, so the workers get the trained agent.
+
+    If record is set, every game that did not crash is appended to the game
+    record file it names (see gameRecords), or to a new timestamped one if
+    record is True.
+    """
     import __main__
     __main__.__dict__['_display'] = display
 
     rules = ClassicGameRules(timeout)
-    games = []
+    results = []
+    recorder = None
+    if record:
+        import gameRecords
+        if record is True:
+            record = 'recorded-games-%s.rec' % time.strftime('%m-%d-%H-%M-%S')
+        recorder = gameRecords.GameRecordWriter(record)
+    numGhosts = min(len(ghosts), layout.getNumGhosts())
+    if workers > 1:
+        numPlayed = numTraining
+    else:
+        numPlayed = numGames
 
-    for i in range(numGames):
+    for i in range(numPlayed):
         beQuiet = i < numTraining
         if beQuiet:
                 # Suppress output and graphics
@@ -691,23 +915,29 @@ def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, c
             rules.quiet = False
         game = rules.newGame(layout, pacman, ghosts,
                              gameDisplay, beQuiet, catchExceptions)
+        startTime = time.time()
         game.run()
         if not beQuiet:
-            games.append(game)
-
-        if record:
-            import time
-            import pickle
-            fname = ('recorded-game-%d' % (i + 1)) + \
-                '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            pickle.dump(components, f)
-            f.close()
+            results.append(GameResult(game, time.time() - startTime, keepActions))
+
+        if recorder and not game.agentCrashed:
+            recorder.writeGame(layout, numGhosts, game.state.getScore(), game.moveHistory)
+
+    if workers > 1 and numGames > numTraining:
+        results = runParallelGames(layout, pacman, ghosts, numGames - numTraining, catchExceptions,
+                                   timeout, workers, numTraining, keepActions or bool(recorder))
+        if recorder:
+            for result in results:
+                if not result.agentCrashed:
+                    recorder.writeGame(layout, numGhosts, result.score, result.getActions())
+                if not keepActions:
+                    result.actionLog = None
+    if recorder:
+        recorder.close()
 
     if (numGames-numTraining) > 0:
-        scores = [game.state.getScore() for game in games]
-        wins = [game.state.isWin() for game in games]
+        scores = [result.score for result in results]
+        wins = [result.win for result in results]
         winRate = wins.count(True) / float(len(wins))
         print('Average Score:', sum(scores) / float(len(scores)))
         print('Scores:       ', ', '.join([str(score) for score in scores]))
@@ -716,7 +946,7 @@ def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, c
         print('Record:       ', ', '.join(
             [['Loss', 'Win'][int(w)] for w in wins]))
 
-    return games
+    return results
 
 
 if __name__ == '__main__':